@@ -0,0 +1,197 @@
+"""
+    Loopback benchmark of the sender and receiver through the impairment proxy
+    Python 3
+    Usage: python3 benchmark.py [--files asyoulik.txt,1M] [--max-win 4000,32000] [--rto 50,200] [--loss 0,0.05]
+           [--latency ms] [--jitter ms] [--reorder p] [--duplicate p] [--rate bytes/s] [--seed n] [--repeat n]
+           [--trace-level summary|connection|packet] [--timeout seconds] [--output baseline.csv]
+    coding: utf-8
+
+    Notes:
+        Every combination of the comma separated --files, --max-win, --rto and --loss values is run --repeat
+        times. A run starts a receiver, a proxy in front of it applying the loss both ways along with the
+        other impairments, and a sender, each in its own process in a scratch directory. Files are either
+        existing paths or sizes such as 64K or 10M, generated from random bytes seeded with --seed.
+
+        Every run records whether the file arrived intact, the completion time and goodput from the
+        sender's metrics summary, and the CPU time of the sender and receiver per MB sent. The rows are
+        written to --output, as CSV if it ends in .csv and JSON otherwise, to be kept as a baseline and
+        compared against in reviews.
+"""
+import argparse, csv, filecmp, itertools, json, os, random, shutil, signal, subprocess, sys, tempfile, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RECEIVER_PORT = 9000
+PROXY_PORT = 9001
+SENDER_PORT = 10000
+# seconds the receiver and proxy get to bind their sockets before the sender starts
+STARTUP = 0.3
+# seconds a run may take before it is killed and recorded as failed
+TIMEOUT = 300
+# size suffixes of generated files
+UNITS = {'K': 1024, 'M': 1024**2, 'G': 1024**3}
+COLUMNS = [
+    'file', 'size', 'max_win', 'rto', 'loss', 'latency', 'jitter', 'reorder', 'duplicate', 'rate', 'seed', 'repeat',
+    'ok', 'completion_s', 'goodput_mbps', 'wall_s', 'sender_cpu_s', 'receiver_cpu_s', 'cpu_s_per_mb',
+    'retransmitted_segments', 'duplicate_acks', 'forward_dropped', 'reverse_dropped',
+]
+
+
+def prepare_file(spec: str, directory: str, seed: int) -> str:
+    '''
+    The file to send for a --files value, either an existing path or a size of random bytes to generate
+    '''
+    if os.path.exists(spec):
+        return os.path.abspath(spec)
+    path = os.path.join(directory, f'{spec}.bin')
+    if not os.path.exists(path):
+        unit = UNITS.get(spec[-1].upper(), 1)
+        size = int(spec[:-1] if unit > 1 else spec) * unit
+        rng = random.Random(seed)
+        with open(path, 'wb') as file:
+            for offset in range(0, size, 1 << 20):
+                file.write(rng.randbytes(min(1 << 20, size - offset)))
+    return path
+
+
+def wait(process: subprocess.Popen, deadline: float):
+    '''
+    Reap a process, killing it once the deadline passes
+    :return: its exit status and the CPU time it used in seconds
+    '''
+    while True:
+        pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+        if pid:
+            break
+        if time.monotonic() > deadline:
+            process.kill()
+            pid, status, usage = os.wait4(process.pid, 0)
+            break
+        time.sleep(0.01)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, usage.ru_utime + usage.ru_stime
+
+
+def summary(path: str) -> dict:
+    '''
+    The last metrics summary in a JSON lines file, empty if the sender never wrote one
+    '''
+    found = {}
+    if os.path.exists(path):
+        with open(path) as file:
+            for line in file:
+                record = json.loads(line)
+                if record.get('type') == 'summary':
+                    found = record
+    return found
+
+
+def run_once(args, filename: str, max_win: int, rto: int, loss: float, repeat: int, workdir: str) -> dict:
+    received = os.path.join(workdir, 'received')
+    metrics_file = os.path.join(workdir, 'metrics.jsonl')
+    for path in (received, metrics_file):
+        if os.path.exists(path):
+            os.remove(path)
+    trace = ['--trace-level', args.trace_level]
+    receiver = subprocess.Popen([sys.executable, os.path.join(HERE, 'receiver.py'), str(RECEIVER_PORT), str(SENDER_PORT), received, '0', '0', *trace],
+                                cwd=workdir, stdout=subprocess.DEVNULL)
+    impairments = ['--loss', str(loss), '--reverse-loss', str(loss), '--latency', str(args.latency), '--jitter', str(args.jitter),
+                   '--reorder', str(args.reorder), '--duplicate', str(args.duplicate), '--seed', str(args.seed + repeat)]
+    if args.rate:
+        impairments += ['--rate', str(args.rate)]
+    proxy = subprocess.Popen([sys.executable, os.path.join(HERE, 'proxy.py'), str(PROXY_PORT), str(RECEIVER_PORT), *impairments],
+                             cwd=workdir, stdout=subprocess.PIPE, text=True)
+    time.sleep(STARTUP)
+
+    start = time.monotonic()
+    sender = subprocess.Popen([sys.executable, os.path.join(HERE, 'sender.py'), str(SENDER_PORT), str(PROXY_PORT), filename, str(max_win), str(rto),
+                               '--metrics', metrics_file, *trace], cwd=workdir, stdout=subprocess.DEVNULL)
+    sender_status, sender_cpu = wait(sender, start + args.timeout)
+    wall = time.monotonic() - start
+    # the receiver lingers in TIME_WAIT, or never got the FIN if the sender gave up
+    receiver_status, receiver_cpu = wait(receiver, time.monotonic() + 10)
+    proxy.send_signal(signal.SIGTERM)
+    try:
+        proxy_stats = json.loads(proxy.communicate(timeout=10)[0] or '{}')
+    except (subprocess.TimeoutExpired, json.JSONDecodeError):
+        proxy.kill()
+        proxy.communicate()
+        proxy_stats = {}
+
+    size = os.path.getsize(filename)
+    result = summary(metrics_file)
+    completion = result.get('duration')
+    ok = sender_status == 0 and os.path.exists(received) and filecmp.cmp(received, filename, shallow=False)
+    return {
+        'file': os.path.basename(filename),
+        'size': size,
+        'max_win': max_win,
+        'rto': rto,
+        'loss': loss,
+        'latency': args.latency,
+        'jitter': args.jitter,
+        'reorder': args.reorder,
+        'duplicate': args.duplicate,
+        'rate': args.rate,
+        'seed': args.seed + repeat,
+        'repeat': repeat,
+        'ok': ok,
+        'completion_s': completion,
+        'goodput_mbps': size * 8 / completion / 1e6 if ok and completion else None,
+        'wall_s': wall,
+        'sender_cpu_s': sender_cpu,
+        'receiver_cpu_s': receiver_cpu,
+        'cpu_s_per_mb': (sender_cpu + receiver_cpu) / (size / 1e6) if size else None,
+        'retransmitted_segments': result.get('stats', {}).get('numDataRetransSegs'),
+        'duplicate_acks': result.get('stats', {}).get('numDupACKS'),
+        'forward_dropped': proxy_stats.get('forward', {}).get('dropped'),
+        'reverse_dropped': proxy_stats.get('reverse', {}).get('dropped'),
+    }
+
+
+def write(rows: list, path: str, parameters: dict) -> None:
+    if path.endswith('.csv'):
+        with open(path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(path, 'w') as file:
+            json.dump({'parameters': parameters, 'runs': rows}, file, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage="python3 benchmark.py [--files asyoulik.txt,1M] [--max-win 4000,32000] [--rto 50,200] [--loss 0,0.05]\n"
+                                           "       [--latency ms] [--jitter ms] [--reorder p] [--duplicate p] [--rate bytes/s] [--seed n] [--repeat n]\n"
+                                           "       [--trace-level summary|connection|packet] [--timeout seconds] [--output baseline.csv]")
+    parser.add_argument('--files', default=f"{os.path.join(HERE, 'asyoulik.txt')},1M", help='comma separated paths or sizes of generated files, e.g. 64K or 10M')
+    parser.add_argument('--max-win', default='4000,32000', help='comma separated sender windows in bytes')
+    parser.add_argument('--rto', default='50,200', help='comma separated initial retransmission timeouts in milliseconds')
+    parser.add_argument('--loss', default='0,0.05', help='comma separated loss probabilities, applied in both directions')
+    parser.add_argument('--latency', type=float, default=0, help='one way delay of the proxy in milliseconds')
+    parser.add_argument('--jitter', type=float, default=0, help='jitter of the proxy in milliseconds')
+    parser.add_argument('--reorder', type=float, default=0, help='probability that the proxy reorders a packet')
+    parser.add_argument('--duplicate', type=float, default=0, help='probability that the proxy duplicates a packet')
+    parser.add_argument('--rate', type=float, help='bandwidth of the proxy towards the receiver in bytes per second')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the proxy and the generated files, incremented per repeat')
+    parser.add_argument('--repeat', type=int, default=1, help='number of runs of every combination')
+    parser.add_argument('--trace-level', choices=['summary', 'connection', 'packet'], default='packet', help='trace level of the sender and receiver')
+    parser.add_argument('--timeout', type=float, default=TIMEOUT, help='seconds before a run is killed and recorded as failed')
+    parser.add_argument('--output', default='baseline.csv', help='file to write the results to, CSV if it ends in .csv and JSON otherwise')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='ptp-benchmark-')
+    rows = []
+    try:
+        files = [prepare_file(spec, workdir, args.seed) for spec in args.files.split(',')]
+        grid = itertools.product(files, [int(w) for w in args.max_win.split(',')], [int(r) for r in args.rto.split(',')],
+                                 [float(l) for l in args.loss.split(',')], range(args.repeat))
+        for filename, max_win, rto, loss, repeat in grid:
+            row = run_once(args, filename, max_win, rto, loss, repeat, workdir)
+            rows.append(row)
+            goodput = f"{row['goodput_mbps']:.2f} Mbit/s" if row['goodput_mbps'] else 'failed'
+            print(f"{row['file']} max_win={max_win} rto={rto} loss={loss} repeat={repeat}: {goodput}, "
+                  f"{row['completion_s'] or 0:.2f} s, {row['cpu_s_per_mb'] or 0:.3f} CPU s/MB", flush=True)
+    finally:
+        write(rows, args.output, vars(args))
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(0 if all(row['ok'] for row in rows) else 1)
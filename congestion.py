@@ -0,0 +1,94 @@
+"""
+    Congestion control for the sender
+    Python 3
+    coding: utf-8
+
+    The sender keeps at most min(cwnd, max_win) bytes in flight and reports acks, fast retransmits and timeouts
+    to one of the algorithms below, picked by name from ALGORITHMS.
+"""
+
+from packet import MSS
+
+# initial congestion window in segments (RFC 3390)
+INITIAL_WINDOW = 4
+
+
+class Reno:
+    def __init__(self, max_cwnd: int, mss: int = MSS) -> None:
+        '''
+        Slow start, congestion avoidance and multiplicative decrease on loss (RFC 5681)
+        :param max_cwnd: the largest the congestion window is allowed to grow, the sender window size
+        :param mss: the segment size the connection negotiated, the unit the congestion window grows and shrinks by
+        '''
+        self.mss = mss
+        self.max_cwnd = max(max_cwnd, mss)
+        self.cwnd = min(INITIAL_WINDOW * mss, self.max_cwnd)
+        self.ssthresh = self.max_cwnd
+
+    def on_ack(self, acked: int, rtt) -> None:
+        '''
+        New data has been acknowledged outside of fast recovery
+        :param acked: the number of bytes newly acknowledged
+        :param rtt: the round trip time sampled from the ack in seconds, or None when the ack was ambiguous
+        '''
+        if self.cwnd < self.ssthresh:
+            self.cwnd += min(acked, self.mss)
+        else:
+            self.cwnd += max(self.mss * self.mss // self.cwnd, 1)
+        self.cwnd = min(self.cwnd, self.max_cwnd)
+
+    def on_recovery_start(self, inflight: int) -> None:
+        '''
+        Halve the window when three duplicate acks signal a loss, inflated by the three segments that left the network
+        '''
+        self.ssthresh = max(inflight // 2, 2 * self.mss)
+        self.cwnd = min(self.ssthresh + 3 * self.mss, self.max_cwnd)
+
+    def on_recovery_dup_ack(self) -> None:
+        '''
+        Every further duplicate ack during fast recovery means another segment has left the network
+        '''
+        self.cwnd = min(self.cwnd + self.mss, self.max_cwnd)
+
+    def on_recovery_end(self) -> None:
+        self.cwnd = self.ssthresh
+
+    def on_timeout(self, inflight: int) -> None:
+        '''
+        A retransmission timeout means the ack clock is lost, so start over from one segment
+        '''
+        self.ssthresh = max(inflight // 2, 2 * self.mss)
+        self.cwnd = self.mss
+
+
+class Vegas(Reno):
+    # bounds on the number of segments queued in the network
+    ALPHA = 2
+    BETA = 4
+
+    def __init__(self, max_cwnd: int, mss: int = MSS) -> None:
+        '''
+        Delay based congestion avoidance, which keeps the queueing delay measured against the lowest RTT seen between ALPHA and BETA segments
+        '''
+        super().__init__(max_cwnd, mss)
+        self.base_rtt = None
+
+    def on_ack(self, acked: int, rtt) -> None:
+        if rtt is not None:
+            self.base_rtt = rtt if self.base_rtt is None else min(self.base_rtt, rtt)
+        if self.cwnd < self.ssthresh or rtt is None or rtt <= 0:
+            super().on_ack(acked, rtt)
+            return
+        # segments sitting in queues along the path, estimated from the gap between the expected and actual rate
+        queued = (self.cwnd / self.mss) * (rtt - self.base_rtt) / rtt
+        if queued < self.ALPHA:
+            self.cwnd += max(self.mss * self.mss // self.cwnd, 1)
+        elif queued > self.BETA:
+            self.cwnd -= max(self.mss * self.mss // self.cwnd, 1)
+        self.cwnd = min(max(self.cwnd, 2 * self.mss), self.max_cwnd)
+
+
+ALGORITHMS = {
+    'reno': Reno,
+    'vegas': Vegas,
+}
@@ -0,0 +1,232 @@
+"""
+    Live metrics of the connections of the sender and receiver
+    Python 3
+    coding: utf-8
+
+    Every connection keeps counters and histograms in a ConnectionMetrics: goodput, throughput over the last
+    interval, round trip times, window occupancy, retransmission rate and the time spent in each State. The
+    connections in progress can be read as JSON over a local HTTP endpoint, dumped periodically as JSON lines,
+    and every connection ends with a summary line including its duration and the Mbit/s it achieved.
+"""
+import asyncio, json, time
+from bisect import bisect_left
+from collections import deque
+
+# upper bounds of the round trip time buckets in milliseconds
+RTT_BOUNDS = [0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+# upper bounds of the window occupancy buckets, the fraction of the window in use
+OCCUPANCY_BOUNDS = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
+# seconds between throughput samples and JSON lines
+INTERVAL = 1.0
+# summaries of finished connections the HTTP endpoint keeps
+FINISHED = 100
+
+
+class Histogram:
+    def __init__(self, bounds: list) -> None:
+        '''
+        :param bounds: the upper bound of every bucket in increasing order, a last bucket takes everything above
+        '''
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, q: float):
+        '''
+        Estimate a quantile as the upper bound of the bucket it falls in, or the largest value for the last bucket
+        '''
+        if not self.count:
+            return None
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+
+    def snapshot(self) -> dict:
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': {**{str(bound): count for bound, count in zip(self.bounds, self.counts)}, '+Inf': self.counts[-1]},
+        }
+
+
+class ConnectionMetrics:
+    def __init__(self, role: str, name: str, stats: dict) -> None:
+        '''
+        :param role: sender or receiver
+        :param name: tells the connection apart from others, such as its addresses
+        :param stats: the stats counters of the connection, reported as they are
+        '''
+        self.role = role
+        self.name = name
+        self.stats = stats
+        self.start = time.time()
+        self.end = None
+        # payload bytes delivered in order, acknowledged ones at the sender and written ones at the receiver
+        self.goodput_bytes = 0
+        # payload bytes on the wire, counting every copy
+        self.wire_bytes = 0
+        # data segments on the wire, and those of them that were retransmissions at the sender or duplicates at the receiver
+        self.wire_segments = 0
+        self.repeated_segments = 0
+        self.rtt = Histogram(RTT_BOUNDS)
+        self.window = Histogram(OCCUPANCY_BOUNDS)
+        # seconds spent in every State but the current one, keyed by name
+        self.state = None
+        self.state_since = time.monotonic()
+        self.state_seconds = {}
+        # throughput in Mbit/s over the last interval and the sample it started from
+        self.throughput = 0.0
+        self.last_sample = (time.monotonic(), 0)
+
+    def set_state(self, state) -> None:
+        now = time.monotonic()
+        if self.state is not None:
+            self.state_seconds[self.state.name] = self.state_seconds.get(self.state.name, 0) + now - self.state_since
+        self.state = state
+        self.state_since = now
+
+    def sample(self) -> None:
+        '''
+        Work out the throughput since the last sample
+        '''
+        now = time.monotonic()
+        then, wire_bytes = self.last_sample
+        if now > then:
+            self.throughput = (self.wire_bytes - wire_bytes) * 8 / (now - then) / 1e6
+        self.last_sample = (now, self.wire_bytes)
+
+    def snapshot(self, kind: str = 'snapshot') -> dict:
+        duration = (self.end or time.time()) - self.start
+        state_seconds = dict(self.state_seconds)
+        if self.state is not None and self.end is None:
+            state_seconds[self.state.name] = state_seconds.get(self.state.name, 0) + time.monotonic() - self.state_since
+        return {
+            'type': kind,
+            'role': self.role,
+            'connection': self.name,
+            'time': time.time(),
+            'duration': duration,
+            'state': self.state.name if self.state is not None else None,
+            'stats': dict(self.stats),
+            'goodput_bytes': self.goodput_bytes,
+            'goodput_mbps': self.goodput_bytes * 8 / duration / 1e6 if duration > 0 else 0.0,
+            'throughput_mbps': self.throughput,
+            'retransmission_rate': self.repeated_segments / self.wire_segments if self.wire_segments else 0.0,
+            'rtt_ms': self.rtt.snapshot(),
+            'window_occupancy': self.window.snapshot(),
+            'state_seconds': state_seconds,
+        }
+
+
+# the connections in progress in this process and the summaries of the last ones that ended
+_live = []
+_finished = deque(maxlen=FINISHED)
+# JSON lines output and the timer writing them, set up by serve
+_file = None
+_timer = None
+
+
+def register(metrics: ConnectionMetrics) -> None:
+    '''
+    Start reporting a connection, from now on
+    '''
+    metrics.start = time.time()
+    metrics.last_sample = (time.monotonic(), metrics.wire_bytes)
+    _live.append(metrics)
+
+
+def finish(metrics: ConnectionMetrics) -> dict:
+    '''
+    Stop reporting a connection and write its summary
+    '''
+    if metrics in _live:
+        _live.remove(metrics)
+    # fold the time in the last state into state_seconds
+    metrics.set_state(metrics.state)
+    metrics.end = time.time()
+    summary = metrics.snapshot('summary')
+    _finished.append(summary)
+    _write(summary)
+    return summary
+
+
+def report() -> dict:
+    return {
+        'connections': [metrics.snapshot() for metrics in _live],
+        'finished': list(_finished),
+    }
+
+
+def _write(line: dict) -> None:
+    if _file is not None:
+        _file.write(json.dumps(line) + '\n')
+        _file.flush()
+
+
+def _tick(loop, interval: float) -> None:
+    global _timer
+    for metrics in _live:
+        metrics.sample()
+        _write(metrics.snapshot())
+    _timer = loop.call_later(interval, _tick, loop, interval)
+
+
+async def _handle(reader, writer) -> None:
+    '''
+    Answer any HTTP request with the report as JSON
+    '''
+    try:
+        await reader.readuntil(b'\r\n\r\n')
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+        pass
+    body = json.dumps(report()).encode()
+    writer.write(b'HTTP/1.0 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n' % len(body) + body)
+    try:
+        await writer.drain()
+    except ConnectionError:
+        pass
+    writer.close()
+
+
+async def serve(awaitable, path: str = None, interval: float = INTERVAL, port: int = None):
+    '''
+    Export metrics while awaiting a transfer
+    :param path: a file to write a JSON line per connection in progress every interval, and every summary, to
+    :param interval: the seconds between JSON lines and throughput samples
+    :param port: a local port to serve the report on over HTTP
+    :return: the result of awaitable
+    '''
+    global _file, _timer
+    loop = asyncio.get_running_loop()
+    _file = open(path, 'w') if path else None
+    server = await asyncio.start_server(_handle, '127.0.0.1', port) if port else None
+    _timer = loop.call_later(interval, _tick, loop, interval)
+    try:
+        return await awaitable
+    finally:
+        _timer.cancel()
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+        if _file is not None:
+            _file.close()
+            _file = None
@@ -0,0 +1,95 @@
+"""
+    PTP packet codec shared by the sender and receiver
+    Python 3
+    coding: utf-8
+
+    Every packet starts with a 2 byte type and a sequence number, 2 bytes wide unless the SYN negotiated 4 byte
+    ones. Headers are packed and unpacked with precompiled structs straight from the receive buffer, and payloads
+    are passed around as memoryviews so they are never copied before they reach the socket or the file.
+
+    Options follow the header of a SYN, of its ACK and of a FIN as (kind, length, value) triples of a 1 byte kind,
+    a 1 byte value length and the value itself. Unknown kinds are skipped, so older peers simply ignore them.
+    A SYN may end in a payload after its options, which is then announced by the last option so parsing can
+    stop there.
+"""
+import socket, struct, zlib
+
+# packet headers keyed by the width of the sequence number
+HEADERS = {
+    2: struct.Struct('!HH'),
+    4: struct.Struct('!HI'),
+}
+# a SACK block is the start and end sequence number of a range the receiver holds
+SACK_BLOCKS = {
+    2: struct.Struct('!HH'),
+    4: struct.Struct('!II'),
+}
+# the value of the STRIPE option, a transfer ID shared by the stripes of a file, the offset of the stripe and the number of stripes
+STRIPE = struct.Struct('!IQH')
+
+# maximum segment size in bytes unless the SYN negotiates another one
+MSS = 1000
+# the largest UDP payload over IPv4
+MAX_DATAGRAM = 65507
+# the largest payload that still fits a UDP datagram after the largest header
+MAX_MSS = MAX_DATAGRAM - HEADERS[4].size
+# scatter/gather sends are not available on every platform
+HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+
+
+def send_packet(transport, sock, address, header: bytes, payload=b'') -> None:
+    '''
+    Send a header and its payload as a single datagram. While nothing is queued in the transport, the datagram is
+    gathered straight from both buffers with sendmsg, otherwise it is queued behind the rest by the transport.
+    :param transport: the asyncio datagram transport wrapping sock
+    :param sock: the non-blocking UDP socket the transport was created with
+    '''
+    if payload and HAS_SENDMSG and not transport.get_write_buffer_size():
+        try:
+            sock.sendmsg([header, payload], [], 0, address)
+            return
+        except (BlockingIOError, InterruptedError):
+            pass
+    transport.sendto(header + payload, address)
+
+
+def encode_options(options: dict) -> bytes:
+    '''
+    :param options: option values as bytes, keyed by OptionType value
+    '''
+    return b''.join(kind.to_bytes(1, 'big') + len(value).to_bytes(1, 'big') + value for kind, value in options.items())
+
+
+def parse_options(data, end: int = None) -> dict:
+    '''
+    Decode the options following a header, ignoring a truncated trailing option
+    :param end: the kind of an option that is the last one, whatever follows it being payload
+    :return: option values as bytes, keyed by OptionType value
+    '''
+    options = {}
+    i = 0
+    while i + 2 <= len(data):
+        kind, length = data[i], data[i + 1]
+        if i + 2 + length > len(data):
+            break
+        options[kind] = bytes(data[i + 2:i + 2 + length])
+        i += 2 + length
+        if kind == end:
+            break
+    return options
+
+
+def file_checksum(filename: str, offset: int, length: int) -> int:
+    '''
+    The CRC-32 of a byte range of a file, read in chunks, as carried by the CHECKSUM option
+    '''
+    checksum = 0
+    with open(filename, 'rb') as file:
+        file.seek(offset)
+        while length > 0:
+            chunk = file.read(min(length, 1 << 20))
+            if not chunk:
+                break
+            checksum = zlib.crc32(chunk, checksum)
+            length -= len(chunk)
+    return checksum
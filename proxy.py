@@ -0,0 +1,203 @@
+"""
+    UDP impairment proxy for testing and benchmarking
+    Python 3
+    Usage: python3 proxy.py listen_port target_port [--loss p] [--reverse-loss p] [--latency ms] [--jitter ms]
+           [--reorder p] [--reorder-delay ms] [--duplicate p] [--rate bytes/s] [--queue bytes] [--seed n]
+    coding: utf-8
+
+    Notes:
+        Run the receiver, then the proxy in front of it, then point the sender at the proxy:
+            python3 receiver.py 9000 10000 FileReceived.txt 0 0
+            python3 proxy.py 9001 9000 --loss 0.05 --latency 10 --jitter 2 --seed 1
+            python3 sender.py 10000 9001 random1.txt 4000 50
+
+        Packets from the sender are forwarded to the target through a socket of their own per sender, and the
+        answers go back the same way. Every packet is dropped, delayed, duplicated and rate limited according
+        to a random number generator seeded with --seed, so the same run makes the same decisions.
+        The rate limit and --loss apply towards the target, --reverse-loss to the answers, while latency,
+        jitter, reordering and duplication apply both ways.
+"""
+import argparse, asyncio, json, random, signal, sys
+from functools import partial
+
+# milliseconds a reordered packet is held back on top of its delay
+REORDER_DELAY = 5
+# bytes a rate limited link queues before dropping packets
+QUEUE_BYTES = 64 * 1024
+
+
+class Impairment:
+    def __init__(self, rng: random.Random, loss: float = 0, latency: float = 0, jitter: float = 0, reorder: float = 0,
+                 reorder_delay: float = REORDER_DELAY, duplicate: float = 0, rate: float = None, queue: int = QUEUE_BYTES) -> None:
+        '''
+        The impairments of one direction
+        :param rng: the random number generator deciding the fate of every packet
+        :param loss: the probability that a packet is dropped
+        :param latency: the delay of every packet in milliseconds
+        :param jitter: the largest random deviation from the latency in milliseconds
+        :param reorder: the probability that a packet is held back by another reorder_delay milliseconds, letting later ones overtake it
+        :param duplicate: the probability that a packet is sent twice
+        :param rate: the bandwidth of the link in bytes per second, or None for no limit
+        :param queue: the bytes waiting for a rate limited link before packets are dropped
+        '''
+        self.rng = rng
+        self.loss = loss
+        self.latency = latency / 1000
+        self.jitter = jitter / 1000
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay / 1000
+        self.duplicate = duplicate
+        self.rate = rate
+        self.queue = queue
+        # when the rate limited link has sent everything queued so far
+        self.link_free = 0
+        self.stats = {
+            'packets': 0,
+            'dropped': 0,
+            'queueDropped': 0,
+            'duplicated': 0,
+            'reordered': 0,
+        }
+
+    def apply(self, loop, data: bytes, deliver) -> None:
+        '''
+        Pass a packet on to deliver once it has gone through the impairments, if it survives them
+        '''
+        self.stats['packets'] += 1
+        if self.loss and self.rng.random() < self.loss:
+            self.stats['dropped'] += 1
+            return
+        copies = 1
+        if self.duplicate and self.rng.random() < self.duplicate:
+            self.stats['duplicated'] += 1
+            copies = 2
+        now = loop.time()
+        for _ in range(copies):
+            departure = now
+            if self.rate:
+                if (self.link_free - now) * self.rate > self.queue:
+                    self.stats['queueDropped'] += 1
+                    continue
+                self.link_free = max(self.link_free, now) + len(data) / self.rate
+                departure = self.link_free
+            delay = self.latency
+            if self.jitter:
+                delay = max(delay + self.rng.uniform(-self.jitter, self.jitter), 0)
+            if self.reorder and self.rng.random() < self.reorder:
+                self.stats['reordered'] += 1
+                delay += self.reorder_delay
+            if departure + delay <= now:
+                deliver(data)
+            else:
+                loop.call_at(departure + delay, deliver, data)
+
+
+class Upstream(asyncio.DatagramProtocol):
+    def __init__(self, proxy, client) -> None:
+        '''
+        The socket forwarding the packets of one sender to the target
+        :param client: the address of the sender, where the answers go back to
+        '''
+        self.proxy = proxy
+        self.client = client
+        self.transport = None
+        # packets that went through the impairments before the socket was ready
+        self.pending = []
+        self.reply = partial(proxy.transport.sendto, addr=client)
+
+    async def connect(self, target) -> None:
+        await self.proxy.loop.create_datagram_endpoint(lambda: self, remote_addr=target)
+        for data in self.pending:
+            self.transport.sendto(data)
+        self.pending = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def error_received(self, exc):
+        # the target is not listening yet or any more, which the sender has to cope with like any loss
+        pass
+
+    def send(self, data: bytes) -> None:
+        if self.pending is not None:
+            self.pending.append(data)
+        else:
+            self.transport.sendto(data)
+
+    def datagram_received(self, data, address):
+        self.proxy.reverse.apply(self.proxy.loop, data, self.reply)
+
+
+class ImpairmentProxy(asyncio.DatagramProtocol):
+    def __init__(self, listen_port: int, target_port: int, forward: Impairment, reverse: Impairment) -> None:
+        '''
+        :param listen_port: the UDP port the senders send to
+        :param target_port: the UDP port of the receiver
+        :param forward: the impairments of the packets towards the receiver
+        :param reverse: the impairments of the packets back to the senders
+        '''
+        self.listen_address = ("127.0.0.1", int(listen_port))
+        self.target_address = ("127.0.0.1", int(target_port))
+        self.forward = forward
+        self.reverse = reverse
+        # forwarding sockets keyed by the address of their sender
+        self.upstreams = {}
+        self.loop = None
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def error_received(self, exc):
+        pass
+
+    def datagram_received(self, data, address):
+        upstream = self.upstreams.get(address)
+        if upstream is None:
+            upstream = self.upstreams[address] = Upstream(self, address)
+            self.loop.create_task(upstream.connect(self.target_address))
+        self.forward.apply(self.loop, data, upstream.send)
+
+    async def run(self) -> None:
+        '''
+        Forward packets until the process is interrupted or terminated
+        '''
+        self.loop = asyncio.get_running_loop()
+        await self.loop.create_datagram_endpoint(lambda: self, local_addr=self.listen_address)
+        stop = self.loop.create_future()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(signum, lambda: stop.done() or stop.set_result(None))
+        await stop
+        self.transport.close()
+        for upstream in self.upstreams.values():
+            if upstream.transport is not None:
+                upstream.transport.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage="python3 proxy.py listen_port target_port [--loss p] [--reverse-loss p] [--latency ms] [--jitter ms]\n"
+                                           "       [--reorder p] [--reorder-delay ms] [--duplicate p] [--rate bytes/s] [--queue bytes] [--seed n]")
+    parser.add_argument('listen_port', type=int)
+    parser.add_argument('target_port', type=int)
+    parser.add_argument('--loss', type=float, default=0, help='probability that a packet towards the target is dropped')
+    parser.add_argument('--reverse-loss', type=float, default=0, help='probability that a packet back from the target is dropped')
+    parser.add_argument('--latency', type=float, default=0, help='one way delay in milliseconds')
+    parser.add_argument('--jitter', type=float, default=0, help='largest random deviation from the latency in milliseconds')
+    parser.add_argument('--reorder', type=float, default=0, help='probability that a packet is held back for --reorder-delay')
+    parser.add_argument('--reorder-delay', type=float, default=REORDER_DELAY, help='milliseconds a reordered packet is held back')
+    parser.add_argument('--duplicate', type=float, default=0, help='probability that a packet is sent twice')
+    parser.add_argument('--rate', type=float, help='bandwidth towards the target in bytes per second')
+    parser.add_argument('--queue', type=int, default=QUEUE_BYTES, help='bytes queued for a rate limited link before packets are dropped')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random number generator')
+    args = parser.parse_args()
+
+    # one generator per direction, so the decisions of one direction do not depend on the packets of the other
+    forward = Impairment(random.Random(args.seed), args.loss, args.latency, args.jitter, args.reorder, args.reorder_delay,
+                         args.duplicate, args.rate, args.queue)
+    reverse = Impairment(random.Random(args.seed + 1), args.reverse_loss, args.latency, args.jitter, args.reorder, args.reorder_delay,
+                         args.duplicate)
+    proxy = ImpairmentProxy(args.listen_port, args.target_port, forward, reverse)
+    asyncio.run(proxy.run())
+    # the counts of both directions, for whoever started the proxy
+    json.dump({'forward': forward.stats, 'reverse': reverse.stats}, sys.stdout)
+    print()
@@ -1,7 +1,9 @@
 """
     Sample code for Receiver
     Python 3
-    Usage: python3 receiver.py receiver_port sender_port FileReceived.txt flp rlp
+    Usage: python3 receiver.py receiver_port sender_port FileReceived.txt flp rlp [--rcv-win bytes] [--server] [--idle-timeout seconds]
+           [--ack-every n] [--ack-delay ms] [--time-wait seconds] [--trace-level summary|connection|packet] [--trace file]
+           [--metrics file] [--metrics-interval seconds] [--metrics-port port]
     coding: utf-8
 
     Notes:
@@ -10,37 +12,512 @@
         Then run the sender:
             python3 sender.py 10000 9000 random1.txt 0 0
 
+        The receiver is an asyncio datagram protocol handling each segment as it arrives, so it shares an event
+        loop with anything else, senders included.
+
+        Every connection is a Session keyed by the sender's address. By default the receiver takes a single
+        connection and quits once it is over, while with --server it keeps serving concurrent senders on the
+        one port and writes each session to its own numbered file, e.g. FileReceived-1.txt.
+
+        The stripes of a striped transfer are separate sessions whose SYNs share a transfer ID, each writing
+        its byte range into the same file. Without --server the receiver then quits once every stripe is over.
+
+        In order segments can be acknowledged together, one ACK for every --ack-every of them or once the
+        --ack-delay timer expires. Out of order segments, duplicates and segments filling a gap are still
+        acknowledged straight away so that the sender's fast retransmit works as before.
+
+        A SYN may carry the first data segment after its options, which is taken as in order data and covered by
+        the ACK of the SYN. A closed session lingers in TIME_WAIT for --time-wait seconds on a timer, to answer a
+        retransmitted FIN, while the sender is already done.
+
+        The SYN of a resumable transfer carries a transfer ID. Its session saves a checkpoint of the contiguous
+        bytes received and their CRC-32 next to the output file, e.g. FileReceived.txt.checkpoint, every
+        CHECKPOINT_BYTES and whenever it ends early. A later SYN with the same transfer ID picks the file up
+        from the checkpoint and tells the sender the offset to resume from straight away, while the bytes kept
+        are checked against the checkpoint off the event loop; a FIN arriving before that is done only has its
+        data acknowledged until it is. In server mode such a transfer is
+        written to a file named after its transfer ID rather than a number, so every attempt finds it. The
+        checksum of the FIN is checked against the data received, and a mismatch resets the connection.
+
+        Events are recorded in the binary trace Receiver_trace.bin and only converted into Receiver_log.txt once
+        the receiver is done, see tracing.py. Live metrics of every session are written as JSON lines to
+        --metrics and served over HTTP on --metrics-port, see metrics.py.
+
     Author: Rui Li (Tutor for COMP3331/9331)
 """
 # here are the libs you may find it useful:
 import datetime, time  # to calculate the time delta of packet transmission
-import logging, sys  # to write the log
+import argparse
 import socket  # Core lib, to send packet via UDP socket
-from threading import Thread  # (Optional)threading will make the timer easily implemented
+import asyncio  # drives the socket and the TIME_WAIT timer from a single event loop
 import random  # for flp and rlp function
+import os, math, json, zlib
+from functools import partial
 
-from type_enums import HeaderType
+from type_enums import HeaderType, OptionType, EventType, TraceLevel
 from state_enums import State
+from writer import FileWriter
+import tracing  # to write the log
+import metrics
+from packet import HEADERS, SACK_BLOCKS, STRIPE, MAX_MSS, send_packet, encode_options, parse_options, file_checksum
+
+# default receive window in bytes, kept below half the sequence space so old and new segments can be told apart
+RCV_WIN = 32000
+# the most SACK blocks carried by a single ACK
+MAX_SACK_BLOCKS = 4
+# default seconds a closed connection lingers to acknowledge a retransmitted FIN
+TIME_WAIT = 2
+# seconds without a packet after which the server gives up on a session, longer than the sender's largest backoff
+IDLE_TIMEOUT = 120
+# by default every segment is acknowledged at once
+ACK_EVERY = 1
+# milliseconds an in order segment may wait for its ACK when ACKs are coalesced
+ACK_DELAY = 40
+# contiguous bytes of a resumable transfer received between checkpoints
+CHECKPOINT_BYTES = 4 * 1024 * 1024
+# appended to the name of the output file to name its checkpoint
+CHECKPOINT_SUFFIX = '.checkpoint'
+
+
+def load_checkpoint(filename: str, resume: int):
+    '''
+    How far an earlier attempt at a resumable transfer into a file got, the bytes kept being checked later by the session
+    :param resume: the transfer ID of the transfer
+    :return: the offset and the checksum of the bytes before it, or None to start from scratch
+    '''
+    try:
+        with open(filename + CHECKPOINT_SUFFIX) as file:
+            checkpoint = json.load(file)
+        if checkpoint['transfer'] == resume and os.path.getsize(filename) >= checkpoint['offset']:
+            return checkpoint['offset'], checkpoint['checksum']
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def remove_checkpoint(filename: str) -> None:
+    try:
+        os.remove(filename + CHECKPOINT_SUFFIX)
+    except FileNotFoundError:
+        pass
+
+
+class Session:
+    def __init__(self, receiver, address, conn_id, filename: str, truncate: bool = True, offset: int = 0, transfer=None,
+                 resume=None, checksum: int = 0) -> None:
+        '''
+        The state of one connection, fed the packets the receiver gets from its sender
+        :param receiver: the Receiver the session belongs to, which sends its packets
+        :param address: the address of the sender
+        :param conn_id: what tells this connection from a new one of the same sender, its connection ID or initial sequence number
+        :param filename: the file the data is written to
+        :param truncate: whether the session is the first to write to the file, rather than one of the later stripes
+        :param offset: the byte offset in the file of the first byte of the connection
+        :param transfer: the transfer ID of the striped transfer the connection belongs to, if any
+        :param resume: the transfer ID of a resumable transfer, whose progress is saved in a checkpoint
+        :param checksum: the CRC-32 of the bytes an earlier attempt received before offset
+        '''
+        self.receiver = receiver
+        self.address = address
+        self.conn_id = conn_id
+        self.filename = filename
+        self.transfer = transfer
+        self.resume = resume
+        self.stats = {
+            'numDataReceivedBytes': 0,
+            'numDataSegs': 0,
+            'numDupSegs': 0,
+            'numOutOfWinSegs': 0,
+            'numDataSegsDrp': 0,
+            'numACKSegsDrp' : 0,
+            'numACKSegs': 0,
+            'numDelayedACKs': 0
+        }
+        self.metrics = metrics.ConnectionMetrics('receiver', f'{address[0]}:{address[1]}->{receiver.address}:{receiver.receiver_port}', self.stats)
+        metrics.register(self.metrics)
+        self.state = State.LISTEN
+
+        self.seqno = -1
+        # sequence numbers are 2 bytes unless the SYN asks for 4 byte ones
+        self.seq_bytes = 2
+        self.seq_space = 2**16
+        self.rcv_win = receiver.rcv_win
+
+        self.start_time = None
+        self.time_wait_timer = None
+        # the ack number and packet answering the SYN, sent again if the SYN is retransmitted
+        self.syn_ack = None
+        # in order segments received since the last ACK, acknowledged together once there are ack_every of them or the ACK timer expires
+        self.unacked = 0
+        self.ack_timer = None
+        # the idle timer is only rearmed when it fires, rather than on every packet
+        self.idle_timer = None
+        self.last_active = receiver.loop.time()
+
+        # lengths of the out of order segments already written past the gap before them, keyed by sequence number
+        self.buffer = {}
+        # total length of the buffered segments
+        self.buffered = 0
+        # byte offset in the file of the next expected byte, self.seqno
+        self.offset = offset
+        # CRC-32 of the contiguous data so far, checked against the one the FIN carries
+        self.checksum = checksum
+        # the offset of the last checkpoint saved
+        self.checkpointed = offset
+        # the checksum of the bytes kept from an earlier attempt while it is read back, and a FIN waiting for it
+        self.verifying = None
+        self.pending_fin = None
+        # reset the file, which then stays open until the transfer ends
+        self.writer = FileWriter(filename, truncate=truncate)
+        if receiver.idle_timeout is not None:
+            self.idle_timer = receiver.loop.call_later(receiver.idle_timeout, self.idle_timeout)
+
+    @property
+    def state(self):
+        return self._state
+
+    @state.setter
+    def state(self, state):
+        # every change of state is timed by the metrics
+        self._state = state
+        self.metrics.set_state(state)
+
+    def elapsed(self) -> float:
+        '''
+        Milliseconds since the SYN arrived, the timestamp of the log
+        '''
+        return (time.time() - self.start_time) * 1000
+
+    def idle_timeout(self):
+        remaining = self.last_active + self.receiver.idle_timeout - self.receiver.loop.time()
+        if remaining > 0:
+            self.idle_timer = self.receiver.loop.call_later(remaining, self.idle_timeout)
+            return
+        tracing.message(f'The connection from {self.address} has been idle for {self.receiver.idle_timeout} seconds')
+        self.close()
 
-BUFFERSIZE = 1024
+    def time_wait_timeout(self):
+        self.close()
 
+    def close(self) -> None:
+        '''
+        End the session, whatever state it is in
+        '''
+        if self.state == State.CLOSED:
+            return
+        self.state = State.CLOSED
+        for timer in (self.time_wait_timer, self.idle_timer, self.ack_timer):
+            if timer is not None:
+                timer.cancel()
+        if self.resume is not None:
+            # ended before the FIN, so keep what arrived for the next attempt
+            self.save_checkpoint()
+        self.writer.close()
+        metrics.finish(self.metrics)
+        self.receiver.reap(self)
+
+    def save_checkpoint(self) -> None:
+        '''
+        Record the contiguous data received so far once it is durable, replacing the previous checkpoint in one step
+        '''
+        self.writer.sync()
+        path = self.filename + CHECKPOINT_SUFFIX
+        with open(path + '.tmp', 'w') as file:
+            json.dump({'transfer': self.resume, 'offset': self.offset, 'checksum': self.checksum}, file)
+        os.replace(path + '.tmp', path)
+        self.checkpointed = self.offset
+
+    def verify_checkpoint(self) -> None:
+        '''
+        Check the bytes an earlier attempt left in the file against the checkpoint, reading them back off the event loop
+        since they may run to gigabytes
+        '''
+        self.verifying = self.receiver.loop.run_in_executor(None, file_checksum, self.filename, 0, self.offset)
+        self.verifying.add_done_callback(partial(self.checkpoint_verified, self.checksum))
+
+    def checkpoint_verified(self, expected: int, future) -> None:
+        self.verifying = None
+        if self.state == State.CLOSED or future.cancelled():
+            return
+        if future.exception() is not None or future.result() != expected:
+            tracing.message(f'{self.filename} no longer matches its checkpoint')
+            self.reject()
+        elif self.pending_fin is not None:
+            self.finish(*self.pending_fin)
+
+    def reject(self) -> None:
+        '''
+        Reset the connection over data that cannot be trusted, dropping the checkpoint as well so the next attempt starts from scratch
+        '''
+        remove_checkpoint(self.filename)
+        self.resume = None
+        self.receiver.send(self.address, HEADERS[self.seq_bytes].pack(HeaderType.RESET.value, 0))
+        tracing.packet(EventType.SND, HeaderType.RESET, 0, 0, self.elapsed())
+        self.close()
 
-class Receiver:
-    def __init__(self, receiver_port: int, sender_port: int, filename: str, flp: float, rlp: float) -> None:
+    def sack_blocks(self) -> bytes:
+        '''
+        Encode the buffered out of order data as SACK blocks, each block being the start and end sequence numbers of a contiguous range
+        '''
+        blocks = []
+        for seqno in sorted(self.buffer, key=lambda seqno: (seqno - self.seqno) % self.seq_space):
+            end = (seqno + self.buffer[seqno]) % self.seq_space
+            if blocks and blocks[-1][1] == seqno:
+                blocks[-1][1] = end
+            else:
+                blocks.append([seqno, end])
+        block = SACK_BLOCKS[self.seq_bytes]
+        return b''.join(block.pack(start, end) for start, end in blocks[:MAX_SACK_BLOCKS])
+
+    def handle(self, header_type: int, seqno: int, options) -> None:
+        '''
+        This function contain the main logic of the receiver, called for every packet of the connection that was not dropped
+        :param options: the bytes following the header, options for a SYN and the payload for DATA
+        '''
+        # nothing but the SYN means anything before it has been answered
+        if self.syn_ack is None and header_type != HeaderType.SYN.value:
+            return
+        self.last_active = self.receiver.loop.time()
+
+        # check the type of header
+        if header_type == HeaderType.SYN.value:
+            data = options
+            options = parse_options(data, OptionType.FAST_OPEN.value)
+            if OptionType.SEQ32.value in options:
+                seqno = int.from_bytes(options[OptionType.SEQ32.value], byteorder='big')
+            # the first data segment follows the options of a fast open
+            length = int.from_bytes(options.get(OptionType.FAST_OPEN.value, b''), byteorder='big')
+            payload = data[len(data) - length:] if 0 < length <= len(data) else b''
+            if self.syn_ack is not None:
+                # the answer was lost, so send it again rather than start over and take the data twice
+                tracing.packet(EventType.RCV, HeaderType.SYN, seqno, len(payload), self.elapsed())
+                ackno, headers = self.syn_ack
+                self.receiver.send(self.address, headers)
+                tracing.packet(EventType.SND, HeaderType.ACK, ackno, 0, self.elapsed())
+                return
+
+            self.state = State.ESTABLISHED
+            reply_options = {}
+            if OptionType.SEQ32.value in options:
+                # switch to 4 byte sequence numbers and echo the full ack number to confirm it
+                self.seq_bytes = 4
+                self.seq_space = 2**32
+            else:
+                self.seq_bytes = 2
+                self.seq_space = 2**16
+            if OptionType.MSS.value in options:
+                # take the sender's segment size as long as a segment still fits a datagram
+                mss = min(int.from_bytes(options[OptionType.MSS.value], byteorder='big'), MAX_MSS)
+                reply_options[OptionType.MSS.value] = mss.to_bytes(2, 'big')
+            # the window has to stay below half the sequence space so old and new segments can be told apart
+            self.rcv_win = min(self.receiver.max_rcv_win, self.seq_space // 2 - 1)
+            # the sender keeps no more than this in flight, so nothing new falls outside the window
+            reply_options[OptionType.WINDOW.value] = self.rcv_win.to_bytes(4, 'big')
+            tracing.packet(EventType.RCV, HeaderType.SYN, seqno, len(payload), 0)
+            self.start_time = time.time()
+            self.seqno = (seqno + 1) % self.seq_space
+            if self.resume is not None:
+                reply_options[OptionType.RESUME.value] = self.offset.to_bytes(8, 'big')
+                if self.offset:
+                    # the data of the SYN is the start of the file, which arrived in an earlier attempt
+                    payload = b''
+                    self.verify_checkpoint()
+            if payload:
+                # nothing can come before the data of the SYN, so it is in order
+                self.writer.write(self.offset, payload)
+                self.checksum = zlib.crc32(payload, self.checksum)
+                self.seqno = (self.seqno + len(payload)) % self.seq_space
+                self.offset += len(payload)
+                self.stats['numDataReceivedBytes'] += len(payload)
+                self.stats['numDataSegs'] += 1
+                self.metrics.goodput_bytes += len(payload)
+                self.metrics.wire_bytes += len(payload)
+                self.metrics.wire_segments += 1
+            if self.seq_bytes == 4:
+                reply_options[OptionType.SEQ32.value] = self.seqno.to_bytes(4, 'big')
+            headers = HEADERS[2].pack(HeaderType.ACK.value, self.seqno % 2**16) + encode_options(reply_options)
+            self.syn_ack = (self.seqno, headers)
+            self.receiver.send(self.address, headers)
+            tracing.packet(EventType.SND, HeaderType.ACK, self.seqno, 0, self.elapsed())
+
+        elif header_type == HeaderType.DATA.value:
+            content = options
+            tracing.packet(EventType.RCV, HeaderType.DATA, seqno, len(content), self.elapsed())
+            self.metrics.wire_bytes += len(content)
+            self.metrics.wire_segments += 1
+            # distance of the segment from the next expected byte, anything past the window is an old duplicate
+            offset = (seqno - self.seqno) % self.seq_space
+            gap_filled = False
+            if offset == 0:
+                # the gap is filled, so the in order data now runs through every contiguous buffered segment
+                gap_filled = bool(self.buffer)
+                start = self.offset
+                self.writer.write(self.offset, content)
+                self.checksum = zlib.crc32(content, self.checksum)
+                self.seqno = (self.seqno + len(content)) % self.seq_space
+                self.offset += len(content)
+                while self.seqno in self.buffer:
+                    size = self.buffer.pop(self.seqno)
+                    self.buffered -= size
+                    self.seqno = (self.seqno + size) % self.seq_space
+                    # buffered segments are only kept on disk, so read them back to checksum them
+                    self.checksum = zlib.crc32(self.writer.read(self.offset, size), self.checksum)
+                    self.offset += size
+                if self.resume is not None and self.offset - self.checkpointed >= CHECKPOINT_BYTES:
+                    self.save_checkpoint()
+                self.metrics.goodput_bytes += self.offset - start
+                self.stats['numDataReceivedBytes'] += len(content)
+                self.stats['numDataSegs'] += 1
+            elif offset < self.rcv_win:
+                if seqno in self.buffer:
+                    self.stats['numDupSegs'] += 1
+                    self.metrics.repeated_segments += 1
+                elif offset + len(content) <= self.rcv_win:
+                    self.writer.write(self.offset + offset, content)
+                    self.buffer[seqno] = len(content)
+                    self.buffered += len(content)
+                    self.stats['numDataReceivedBytes'] += len(content)
+                    self.stats['numDataSegs'] += 1
+                else:
+                    # new data running past the end of the window
+                    self.stats['numOutOfWinSegs'] += 1
+            elif offset < self.seq_space // 2:
+                # new data beyond the window, which a sender keeping to the advertised window never sends
+                self.stats['numOutOfWinSegs'] += 1
+            else:
+                self.stats['numDupSegs'] += 1
+                self.metrics.repeated_segments += 1
+            self.metrics.window.observe(self.buffered / self.rcv_win)
+
+            # only a segment extending the in order data without filling a gap may wait for its ACK
+            if offset == 0 and not gap_filled and self.receiver.ack_every > 1:
+                self.unacked += 1
+                if self.unacked >= self.receiver.ack_every:
+                    self.send_ack()
+                elif self.ack_timer is None:
+                    self.ack_timer = self.receiver.loop.call_later(self.receiver.ack_delay, self.ack_timeout)
+            else:
+                self.send_ack()
+
+        elif header_type == HeaderType.FIN.value:
+            tracing.packet(EventType.RCV, HeaderType.FIN, self.seqno, 0, self.elapsed())
+            if self.verifying is not None:
+                # the FIN waits for the bytes kept from an earlier attempt to be checked, and acknowledging the data tells the sender so
+                self.pending_fin = (seqno, bytes(options))
+                self.send_ack()
+                return
+            self.finish(seqno, options)
+
+    def finish(self, seqno: int, options) -> None:
+        '''
+        Verify the file against the checksum of the FIN and acknowledge it, lingering in TIME_WAIT
+        '''
+        # an older sender leaves the checksum out
+        checksum = parse_options(options).get(OptionType.CHECKSUM.value)
+        if checksum is not None and int.from_bytes(checksum, byteorder='big') != self.checksum:
+            tracing.message(f'The data from {self.address} does not match the checksum of its FIN')
+            self.reject()
+            return
+        self.seqno = (seqno + 1) % self.seq_space
+        # the ACK of the FIN covers any data still waiting for its ACK
+        self.cancel_ack()
+        # everything has arrived, so make it durable before acknowledging the FIN
+        self.writer.close(sync=True)
+        if self.resume is not None:
+            # the transfer is over, so there is nothing left to resume
+            remove_checkpoint(self.filename)
+            self.resume = None
+        headers = HEADERS[self.seq_bytes].pack(HeaderType.ACK.value, self.seqno)
+        self.receiver.send(self.address, headers)
+        tracing.packet(EventType.SND, HeaderType.ACK, self.seqno, 0, self.elapsed())
+
+        # a retransmitted FIN means the ack was lost, so acknowledge it again and restart TIME_WAIT
+        if self.time_wait_timer is not None:
+            self.time_wait_timer.cancel()
+        self.state = State.TIME_WAIT
+        self.time_wait_timer = self.receiver.loop.call_later(self.receiver.time_wait, self.time_wait_timeout)
+
+    def send_ack(self) -> None:
+        '''
+        Send the cumulative ack for the in order data followed by the buffered ranges
+        '''
+        self.cancel_ack()
+        headers = HEADERS[self.seq_bytes].pack(HeaderType.ACK.value, self.seqno) + self.sack_blocks()
+        tracing.packet(EventType.SND, HeaderType.ACK, self.seqno, 0, self.elapsed())
+        self.stats['numACKSegs'] += 1
+        # probability that the packet gets lost on the way back
+        if random.randint(1, 100) >= int(self.receiver.rlp * 100):
+            self.receiver.send(self.address, headers)
+        else:
+            self.stats['numACKSegsDrp'] += 1
+
+    def cancel_ack(self) -> None:
+        self.unacked = 0
+        if self.ack_timer is not None:
+            self.ack_timer.cancel()
+            self.ack_timer = None
+
+    def ack_timeout(self):
+        self.ack_timer = None
+        self.stats['numDelayedACKs'] += 1
+        self.send_ack()
+
+    def drop(self, header_type: int, seqno: int, length: int) -> None:
+        '''
+        Log a packet lost to the forward loss probability
+        :param seqno: the sequence number in the header, logged for a SYN since the session has none of its own yet
+        '''
+        if self.syn_ack is None and header_type != HeaderType.SYN.value:
+            return
+        if header_type == HeaderType.DATA.value:
+            tracing.packet(EventType.DRP, HeaderType.DATA, self.seqno, length, self.elapsed())
+            self.stats['numDataSegsDrp'] += 1
+        elif header_type == HeaderType.SYN.value:
+            tracing.packet(EventType.DRP, HeaderType.SYN, seqno, 0, math.nan)
+        elif header_type == HeaderType.FIN.value:
+            tracing.packet(EventType.DRP, HeaderType.FIN, self.seqno, 0, self.elapsed())
+
+    def log_stats(self) -> None:
+        tracing.message(f"Amount of original data received in bytes: {self.stats['numDataReceivedBytes']}")
+        tracing.message(f"Number of original data segments received: {self.stats['numDataSegs']}")
+        tracing.message(f"Number of duplicate data segments received: {self.stats['numDupSegs']}")
+        tracing.message(f"Number of data segments dropped: {self.stats['numDataSegsDrp']}")
+        tracing.message(f"Number of data segments outside the receive window: {self.stats['numOutOfWinSegs']}")
+        tracing.message(f"Number of ACK segments dropped: {self.stats['numACKSegsDrp']}")
+        tracing.message(f"Number of ACK segments sent for data: {self.stats['numACKSegs']}")
+        tracing.message(f"Number of ACK segments sent by the delayed ACK timer: {self.stats['numDelayedACKs']}")
+
+
+class Receiver(asyncio.DatagramProtocol):
+    def __init__(self, receiver_port: int, sender_port: int, filename: str, flp: float, rlp: float, rcv_win: int = RCV_WIN,
+                 server: bool = False, idle_timeout: float = IDLE_TIMEOUT, ack_every: int = ACK_EVERY, ack_delay: int = ACK_DELAY,
+                 time_wait: float = TIME_WAIT) -> None:
         '''
         The server will be able to receive the file from the sender via UDP
         :param receiver_port: the UDP port number to be used by the receiver to receive PTP segments from the sender.
         :param sender_port: the UDP port number to be used by the sender to send PTP segments to the receiver.
-        :param filename: the name of the text file into which the text sent by the sender should be stored
+        :param filename: the name of the text file into which the text sent by the sender should be stored, numbered per session in server mode
         :param flp: forward loss probability, which is the probability that any segment in the forward direction (Data, FIN, SYN) is lost.
         :param rlp: reverse loss probability, which is the probability of a segment in the reverse direction (i.e., ACKs) being lost.
-
+        :param rcv_win: the receive window in bytes, bounding how much out of order data is buffered.
+        :param server: whether to keep serving any number of concurrent connections rather than quit after the first one.
+        :param idle_timeout: the seconds of silence after which a session is dropped in server mode, or None to wait forever.
+        :param ack_every: the number of in order segments acknowledged by a single ACK.
+        :param ack_delay: the milliseconds an in order segment may wait for its ACK, keep it well below the sender's rto.
+        :param time_wait: the seconds a session lingers after the FIN to acknowledge a retransmitted one.
         '''
         self.receiver_port = int(receiver_port)
         self.sender_port = int(sender_port)
         self.filename = filename
         self.flp = float(flp)
         self.rlp = float(rlp)
+        self.max_rcv_win = int(rcv_win)
+        self.rcv_win = min(self.max_rcv_win, 2**15 - 1)
+        self.server = server
+        self.idle_timeout = idle_timeout if server else None
+        self.ack_every = max(int(ack_every), 1)
+        self.ack_delay = int(ack_delay) / 1000
+        self.time_wait = float(time_wait)
 
         self.address = "127.0.0.1"
         self.server_address = (self.address, self.receiver_port)
@@ -52,137 +529,177 @@ class Receiver:
         print(f"The sender is using the address {self.server_address} to receive message!")
         self.receiver_socket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
         self.receiver_socket.bind(self.server_address)
+        # set up by run() once the event loop is running
+        self.loop = None
+        self.transport = None
 
         self.state = State.LISTEN
 
-        self.seqno = -1
+        # the open connections keyed by the address of their sender
+        self.sessions = {}
+        # number of output files opened so far, which numbers them in server mode
+        self.file_count = 0
+        # the output file, stripe count and number of closed stripes of the striped transfers in progress, keyed by transfer ID
+        self.transfers = {}
+        # resolved once the receiver stops serving
+        self.end = None
 
-        self.end = False
+    def send(self, address, header: bytes) -> None:
+        send_packet(self.transport, self.receiver_socket, address, header)
 
-        self.start_time = None
+    def open_session(self, sender_address, conn_id, transfer=None, offset: int = 0, stripes: int = 1, resume=None) -> Session:
+        '''
+        Set up the session of a new connection, writing to a new file unless it is a further stripe of a transfer in progress
+        or a resumable transfer with a checkpoint
+        '''
+        if transfer in self.transfers:
+            return Session(self, sender_address, conn_id, self.transfers[transfer]['filename'], False, offset, transfer)
+        self.file_count += 1
+        if self.server:
+            root, ext = os.path.splitext(self.filename)
+            # every attempt at a resumable transfer writes to the same file
+            filename = f'{root}-{resume:08x}{ext}' if resume is not None else f'{root}-{self.file_count}{ext}'
+        else:
+            filename = self.filename
+        if transfer is not None:
+            self.transfers[transfer] = {'filename': filename, 'stripes': stripes, 'closed': 0}
+            resume = None
+        if resume is not None:
+            checkpoint = load_checkpoint(filename, resume)
+            if checkpoint is not None:
+                tracing.message(f'Resuming the transfer into {filename} from byte {checkpoint[0]}')
+                return Session(self, sender_address, conn_id, filename, False, checkpoint[0], resume=resume, checksum=checkpoint[1])
+        # the file starts from scratch, so a checkpoint of whatever was in it before is stale
+        remove_checkpoint(filename)
+        return Session(self, sender_address, conn_id, filename, True, offset, transfer, resume)
+
+    def reap(self, session: Session) -> None:
+        '''
+        Forget a closed session, which ends the receiver once its transfer is over unless it is a server
+        '''
+        if self.sessions.get(session.address) is session:
+            del self.sessions[session.address]
+        finished = True
+        transfer = self.transfers.get(session.transfer)
+        if transfer is not None:
+            transfer['closed'] += 1
+            finished = transfer['closed'] == transfer['stripes']
+            if finished:
+                del self.transfers[session.transfer]
+        if self.server:
+            tracing.message(f'Session {session.filename} from {session.address} closed')
+        session.log_stats()
+        if finished and not self.server:
+            self.stop()
+
+    def stop(self) -> None:
+        self.state = State.CLOSED
+        for session in list(self.sessions.values()):
+            session.close()
+        if not self.end.done():
+            self.end.set_result(None)
 
-        # listener when receiver is in TIME_WAIT state
-        self._is_active = True  # for the multi-threading
-        self.listen_thread = Thread(target=self.listen)
+    def connection_made(self, transport):
+        self.transport = transport
 
-        self.db = {}
-        self.stats = {
-            'numDataReceivedBytes': 0,
-            'numDataSegs': 0,
-            'numDupSegs': 0,
-            'numDataSegsDrp': 0,
-            'numACKSegsDrp' : 0
-        }
+    def error_received(self, exc):
+        # an ICMP error such as port unreachable, the sender retransmits whatever got lost
+        pass
 
-    def listen(self):
-        while self._is_active:
-            start_time = time.time()
-            while time.time() - start_time < 2:
-                continue
-            self._is_active = False
+    def lost(self) -> bool:
+        '''
+        Probability that the packet gets lost to the receiver
+        '''
+        return random.randint(1, 100) <= int(self.flp * 100)
 
-        self.state = State.CLOSED
-        self.end = True
-
-    def run(self) -> None:
-        '''
-        This function contain the main logic of the receiver
-        '''
-        # reset the file
-        with open(self.filename, 'w') as file:
-                # Write the string to the file
-                file.write('')
-
-        while self.end == False:
-            # try to receive any incoming message from the sender
-            try:
-                incoming_message, sender_address = self.receiver_socket.recvfrom(BUFFERSIZE)
-
-                seqno = int.from_bytes(incoming_message[2:4], byteorder='big')
-                header_type = int.from_bytes(incoming_message[0:2], byteorder='big')
-
-                if header_type == HeaderType.RESET.value:
-                    logging.info('The connection has been reset')
-                    self.end = True
-                    break
-
-                # probability that the packet gets lost to the receiver
-                if random.randint(1, 100) <= int(self.flp * 100):
-                    if header_type == HeaderType.DATA.value:
-                        logging.info(f'drp\x20\x20\x20\x20{((time.time()-self.start_time)*1000):.2f}\x20\x20\x20\x20DATA\x20\x20\x20\x20{self.seqno}\x20\x20\x20\x20{len(incoming_message[4:])}')
-                        self.stats['numDataSegsDrp'] += 1
-                    elif header_type == HeaderType.SYN.value:
-                        logging.info(f'drp\x20\x20\x20\x20uninitalised\x20\x20\x20\x20SYN\x20\x20\x20\x20{self.seqno}\x20\x20\x20\x20{0}')
-                    elif header_type == HeaderType.FIN.value:
-                        logging.info(f'drp\x20\x20\x20\x20{((time.time()-self.start_time)*1000):.2f}\x20\x20\x20\x20FIN\x20\x20\x20\x20{self.seqno}\x20\x20\x20\x20{0}')
-                    continue
-
-                # check the type of header
-                if header_type == HeaderType.SYN.value:
-                    self.state = State.ESTABLISHED
-                    logging.info(f'rcv\x20\x20\x20\x20{0:.2f}\x20\x20\x20\x20SYN\x20\x20\x20\x20{seqno}\x20\x20\x20\x20{0}')
-                    self.start_time = time.time()
-                    self.seqno = (seqno + 1) % (2**16)
-                    ack_header_type = HeaderType.ACK.value
-                    headers = ack_header_type.to_bytes(2, 'big') + self.seqno.to_bytes(2, 'big')
-                    self.receiver_socket.sendto(headers, sender_address)
-                    logging.info(f'snd\x20\x20\x20\x20{((time.time()-self.start_time)*1000):.2f}\x20\x20\x20\x20ACK\x20\x20\x20\x20{self.seqno}\x20\x20\x20\x20{0}')
-
-                elif header_type == HeaderType.DATA.value:
-                    logging.info(f'rcv\x20\x20\x20\x20{((time.time()-self.start_time)*1000):.2f}\x20\x20\x20\x20DATA\x20\x20\x20\x20{seqno}\x20\x20\x20\x20{len(incoming_message[4:])}')
-                    if seqno not in self.db:
-                        # Write the string to the file
-                        with open(self.filename, 'a') as file:
-                            file.write(incoming_message[4:].decode('utf-8'))
-                            self.seqno = (self.seqno + len(incoming_message[4:])) % (2**16)
-                            self.stats['numDataReceivedBytes'] += len(incoming_message[4:])
-                            self.stats['numDataSegs'] += 1
-
-                    # check if that packet sequence number is already in the data to find if it is a duplicate
-                    if seqno in self.db:
-                        self.stats['numDupSegs'] += 1
-
-                    ack_header_type = HeaderType.ACK.value
-                    headers = ack_header_type.to_bytes(2, 'big') + self.seqno.to_bytes(2, 'big')
-                    logging.info(f'snd\x20\x20\x20\x20{((time.time()-self.start_time)*1000):.2f}\x20\x20\x20\x20ACK\x20\x20\x20\x20{self.seqno}\x20\x20\x20\x20{0}')
-                    self.db[seqno] = self.db.get(seqno, 0) + 1
-                    # probability that the packet gets lost on the way back
-                    if random.randint(1, 100) >= int(self.rlp * 100):
-                        self.receiver_socket.sendto(headers, sender_address)
-                    else:
-                        self.stats['numACKSegsDrp'] += 1
-
-                elif header_type == HeaderType.FIN.value:
-                    logging.info(f'rcv\x20\x20\x20\x20{((time.time()-self.start_time)*1000):.2f}\x20\x20\x20\x20FIN\x20\x20\x20\x20{self.seqno}\x20\x20\x20\x20{0}')
-                    self.seqno = (seqno + 1) % (2**16)
-                    ack_header_type = HeaderType.ACK.value
-                    headers = ack_header_type.to_bytes(2, 'big') + self.seqno.to_bytes(2, 'big')
-                    self.receiver_socket.sendto(headers, sender_address)
-                    logging.info(f'snd\x20\x20\x20\x20{((time.time()-self.start_time)*1000):.2f}\x20\x20\x20\x20ACK\x20\x20\x20\x20{self.seqno}\x20\x20\x20\x20{0}')
-
-                    self.state = State.TIME_WAIT
-                    self.listen_thread.start()
-                    time.sleep(5)
-
-            except ConnectionResetError:
-                continue
-        logging.info(f"Amount of original data received in bytes: {self.stats['numDataReceivedBytes']}")
-        logging.info(f"Number of original data segments received: {self.stats['numDataSegs']}")
-        logging.info(f"Number of duplicate data segments received: {self.stats['numDupSegs']}")
-        logging.info(f"Number of data segments dropped: {self.stats['numDataSegsDrp']}")
-        logging.info(f"Number of ACK segments dropped: {self.stats['numACKSegsDrp']}")
+    def datagram_received(self, data, sender_address) -> None:
+        '''
+        Hand an incoming message to the session of its sender, setting up a new session for the SYN of a new connection
+        '''
+        incoming_message = memoryview(data)
+        nbytes = len(data)
+        if nbytes < HEADERS[2].size or self.state == State.CLOSED:
+            return
+
+        header_type, seqno = HEADERS[2].unpack_from(incoming_message)
+        session = self.sessions.get(sender_address)
+        if header_type == HeaderType.SYN.value:
+            # a SYN always has a 2 byte sequence number, its options tell whether it opens a new connection
+            options = parse_options(incoming_message[HEADERS[2].size:], OptionType.FAST_OPEN.value)
+            conn_id = options.get(OptionType.CONN_ID.value, seqno)
+            if session is None or session.conn_id != conn_id:
+                transfer, offset, stripes, resume = None, 0, 1, None
+                if len(options.get(OptionType.STRIPE.value, b'')) == STRIPE.size:
+                    transfer, offset, stripes = STRIPE.unpack(options[OptionType.STRIPE.value])
+                if len(options.get(OptionType.RESUME.value, b'')) == 4:
+                    resume = int.from_bytes(options[OptionType.RESUME.value], byteorder='big')
+                # a single receiver only takes one transfer, though that may come in several stripes
+                if not self.server and self.file_count and transfer not in self.transfers:
+                    return
+                # the loss is rolled before anything is set up, a lost SYN leaves the last session and the file alone
+                if self.lost():
+                    tracing.packet(EventType.DRP, HeaderType.SYN, seqno, 0, math.nan)
+                    return
+                if session is not None:
+                    session.close()
+                session = self.open_session(sender_address, conn_id, transfer, offset, stripes, resume)
+                self.sessions[sender_address] = session
+                session.handle(header_type, seqno, incoming_message[HEADERS[2].size:])
+                return
+            header = HEADERS[2]
+        elif session is None:
+            return
+        elif header_type == HeaderType.RESET.value:
+            # the type comes first at either header width, and a sender giving up in SYN_SENT resets with the 2 byte header
+            tracing.message('The connection has been reset')
+            session.close()
+            return
+        else:
+            # the rest use whatever the SYN negotiated
+            header = HEADERS[session.seq_bytes]
+            if nbytes < header.size:
+                return
+            header_type, seqno = header.unpack_from(incoming_message)
+
+        if self.lost():
+            session.drop(header_type, seqno, nbytes - header.size)
+            return
+
+        session.handle(header_type, seqno, incoming_message[header.size:])
+
+    async def run(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.end = self.loop.create_future()
+        await self.loop.create_datagram_endpoint(lambda: self, sock=self.receiver_socket)
+        await self.end
+        self.transport.close()
 
 if __name__ == '__main__':
-    logging.basicConfig(
-        filename="Receiver_log.txt",
-        level=logging.DEBUG,
-        format='',
-        filemode='w')
-
-    if len(sys.argv) != 6:
-        print(
-            "\n===== Error usage, python3 receiver.py receiver_port sender_port FileReceived.txt flp rlp ======\n")
-        exit(0)
-
-    receiver = Receiver(*sys.argv[1:])
-    receiver.run()
+    parser = argparse.ArgumentParser(usage="python3 receiver.py receiver_port sender_port FileReceived.txt flp rlp [--rcv-win bytes] [--server] [--idle-timeout seconds] [--ack-every n] [--ack-delay ms] [--time-wait seconds]\n"
+                                           "       [--trace-level summary|connection|packet] [--trace file]\n"
+                                           "       [--metrics file] [--metrics-interval seconds] [--metrics-port port]")
+    parser.add_argument('receiver_port', type=int)
+    parser.add_argument('sender_port', type=int)
+    parser.add_argument('filename')
+    parser.add_argument('flp', type=float)
+    parser.add_argument('rlp', type=float)
+    parser.add_argument('--rcv-win', type=int, default=RCV_WIN, help='receive window in bytes, bounding the out of order data buffered')
+    parser.add_argument('--server', action='store_true', help='keep serving concurrent connections, each written to its own numbered file')
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT, help='seconds of silence after which a server drops a session')
+    parser.add_argument('--ack-every', type=int, default=ACK_EVERY, help='number of in order segments acknowledged by a single ACK')
+    parser.add_argument('--ack-delay', type=int, default=ACK_DELAY, help='milliseconds an in order segment may wait for its ACK')
+    parser.add_argument('--time-wait', type=float, default=TIME_WAIT, help='seconds a session lingers after the FIN to acknowledge a retransmitted one')
+    parser.add_argument('--trace-level', choices=[level.name.lower() for level in TraceLevel], default='packet', help='the most detailed events to log')
+    parser.add_argument('--trace', default='Receiver_trace.bin', help='binary trace file, converted into Receiver_log.txt at the end')
+    parser.add_argument('--metrics', help='file to write live metrics and the summary of every session to as JSON lines')
+    parser.add_argument('--metrics-interval', type=float, default=metrics.INTERVAL, help='seconds between metrics lines')
+    parser.add_argument('--metrics-port', type=int, help='local port to serve live metrics on over HTTP')
+    args = parser.parse_args()
+
+    tracing.configure(args.trace, TraceLevel[args.trace_level.upper()])
+    try:
+        receiver = Receiver(args.receiver_port, args.sender_port, args.filename, args.flp, args.rlp, args.rcv_win, args.server, args.idle_timeout,
+                            args.ack_every, args.ack_delay, args.time_wait)
+        asyncio.run(metrics.serve(receiver.run(), args.metrics, args.metrics_interval, args.metrics_port))
+    finally:
+        tracing.close("Receiver_log.txt")
@@ -0,0 +1,57 @@
+"""
+    Round trip time estimation for the sender
+    Python 3
+    coding: utf-8
+
+    Keeps a smoothed round trip time and its variation (RFC 6298) to derive the retransmission timeout,
+    doubling the timeout on every expiry until a fresh sample arrives.
+"""
+
+# gains of the smoothed round trip time and its variation
+ALPHA = 1 / 8
+BETA = 1 / 4
+# clock granularity in seconds, the timeout never drops below it so that backing off always makes progress
+GRANULARITY = 0.001
+# upper bound of the retransmission timeout in seconds, however often it backs off
+MAX_RTO = 60
+
+
+class RttEstimator:
+    def __init__(self, rto: float) -> None:
+        '''
+        :param rto: the initial retransmission timeout in seconds, also used as the lowest timeout the estimate may reach
+        '''
+        self.min_rto = max(rto, GRANULARITY)
+        self.srtt = None
+        self.rttvar = None
+        self.backoff = 1
+        self._rto = self.min_rto
+
+    @property
+    def rto(self) -> float:
+        '''
+        The current retransmission timeout in seconds, including any backoff
+        '''
+        return min(self._rto * self.backoff, MAX_RTO)
+
+    def sample(self, rtt: float) -> None:
+        '''
+        Fold in a round trip time measured from a packet that was only sent once (Karn's rule)
+        :param rtt: the measured round trip time in seconds
+        '''
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * rtt
+        self._rto = max(self.srtt + max(GRANULARITY, 4 * self.rttvar), self.min_rto)
+        # a valid sample means the path is delivering again
+        self.backoff = 1
+
+    def timeout(self) -> None:
+        '''
+        Back off exponentially after a retransmission timer expires
+        '''
+        if self.rto < MAX_RTO:
+            self.backoff *= 2
@@ -0,0 +1,46 @@
+"""
+    Streaming file segmentation for the sender
+    Python 3
+    coding: utf-8
+
+    The file is memory mapped rather than read up front, so segments are cut on demand as the window opens
+    and the sender only holds on to the ones still in flight. Segments are memoryviews into the mapping, so
+    the payload is not copied until the kernel sends it. A segmenter can also cover just a byte range of the
+    file, the stripe a single connection of a striped transfer is responsible for.
+"""
+import mmap, os
+
+
+class Segmenter:
+    def __init__(self, filename: str, mss: int, offset: int = 0, length: int = None) -> None:
+        '''
+        :param filename: the file to split into segments, read as raw bytes
+        :param mss: the size of every segment but the last
+        :param offset: the first byte of the file to send
+        :param length: the number of bytes to send from offset, by default the rest of the file
+        '''
+        self.mss = mss
+        self.file = open(filename, 'rb')
+        file_size = os.fstat(self.file.fileno()).st_size
+        offset = min(offset, file_size)
+        self.size = file_size - offset if length is None else min(length, file_size - offset)
+        # number of segments, rounded up so the last one carries the remainder
+        self.count = -(-self.size // mss)
+        # an empty file cannot be mapped, but then there is nothing to slice either
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if file_size else b''
+        self.view = memoryview(self.data)[offset:offset + self.size]
+
+    def segment_size(self, index: int) -> int:
+        return min(self.mss, self.size - index * self.mss)
+
+    def segment(self, index: int) -> memoryview:
+        return self.view[index * self.mss:(index + 1) * self.mss]
+
+    def close(self) -> None:
+        '''
+        Unmap the file, every segment handed out must have been dropped by now
+        '''
+        self.view.release()
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
@@ -1,7 +1,9 @@
 """
-    Sample code for Sender (multi-threading)
+    Sample code for Sender (asyncio)
     Python 3
-    Usage: python3 sender.py receiver_port sender_port FileToSend.txt max_recv_win rto
+    Usage: python3 sender.py receiver_port sender_port FileToSend.txt max_recv_win rto [--cc reno|vegas] [--mss bytes] [--stripes n] [--processes n] [--fast-open] [--resume]
+           [--trace-level summary|connection|packet] [--trace file]
+           [--metrics file] [--metrics-interval seconds] [--metrics-port port]
     coding: utf-8
 
     Notes:
@@ -10,36 +12,85 @@
         Then run the sender:
             python3 sender.py 10000 9000 random1.txt 0 0
 
+        The sender is an asyncio datagram protocol, so every timer is a loop callback and several transfers
+        can share one event loop, e.g. asyncio.gather(Sender(...).run(), Sender(...).run()).
+
+        With --stripes n the file is split into n byte ranges sent over n connections from consecutive sender
+        ports, all sharing the event loop or spread over a pool of --processes worker processes. The receiver
+        puts the stripes back together by offset, and the transfer only counts as complete once every stripe's
+        FIN is acknowledged.
+
+        With --fast-open the first data segment rides with the SYN, so a file of a single segment is delivered
+        in one round trip. A receiver that does not take it acknowledges the SYN alone and the segment is sent
+        again as usual. The sender returns as soon as its FIN is acknowledged, leaving TIME_WAIT to the receiver.
+
+        With --resume the SYN carries a transfer ID derived from the file, and a receiver holding a checkpoint of
+        an earlier attempt at the same transfer answers with the offset it got to, which the sender seeks to.
+        Whether resumed or not, the FIN carries a CRC-32 of the data, so the receiver verifies the whole file
+        end to end and resets the connection if it does not match. The sender exits with status 1 unless the
+        transfer completed, so a script can simply run it again.
+
+        Events are recorded in the binary trace Sender_trace.bin and only converted into Sender_log.txt once the
+        sender is done, see tracing.py. Live metrics are written as JSON lines to --metrics and served over
+        HTTP on --metrics-port, see metrics.py.
+
     Author: Rui Li (Tutor for COMP3331/9331)
 """
 # here are the libs you may find it useful:
 import datetime, time  # to calculate the time delta of packet transmission
-import logging, sys  # to write the log
+import argparse
 import socket  # Core lib, to send packet via UDP socket
-from threading import Thread  # (Optional)threading will make the timer easily implemented
+import asyncio  # drives the socket and every timer from a single event loop
 import random
+import os, sys, zlib
+from concurrent.futures import ProcessPoolExecutor
 
-from type_enums import HeaderType
+from type_enums import HeaderType, OptionType, EventType, TraceLevel
 from state_enums import State
+from rtt import RttEstimator
+from congestion import ALGORITHMS
+from segmenter import Segmenter
+import tracing  # to write the log
+import metrics
+from packet import HEADERS, SACK_BLOCKS, STRIPE, MSS, MAX_MSS, MAX_DATAGRAM, send_packet, encode_options, parse_options, file_checksum
 
-BUFFERSIZE = 1024
+# duplicate acks for the send base that trigger a fast retransmit
+DUP_ACK_THRESHOLD = 3
 
 # max_win is the maximum window size in byte for the sender window. Greater or equal to 1000 and a multiple of 1000.
-class Sender:
-    def __init__(self, sender_port: int, receiver_port: int, filename: str, max_win : int, rto: int) -> None:
+class Sender(asyncio.DatagramProtocol):
+    def __init__(self, sender_port: int, receiver_port: int, filename: str, max_win : int, rto: int, cc: str = 'reno', mss: int = MSS,
+                 offset: int = 0, length: int = None, transfer_id: int = None, stripes: int = 1, fast_open: bool = False,
+                 resume: bool = False) -> None:
         '''
         The Sender will be able to connect the Receiver via UDP
         :param sender_port: the UDP port number to be used by the sender to send PTP segments to the receiver
         :param receiver_port: the UDP port number on which receiver is expecting to receive PTP segments from the sender
         :param filename: the name of the text file that must be transferred from sender to receiver using your reliable transport protocol.
         :param max_win: the maximum window size in bytes for the sender window.
-        :param rto: the value of the retransmission timer in milliseconds. This should be an unsigned integer.
+        :param rto: the initial and minimum value of the retransmission timer in milliseconds, which then adapts to the measured round trip time. This should be an unsigned integer.
+        :param cc: the congestion control algorithm, one of the names in congestion.ALGORITHMS.
+        :param mss: the segment size in bytes to propose in the SYN, the receiver may lower it.
+        :param offset: the first byte of the file to send, when the connection carries one stripe of it.
+        :param length: the number of bytes to send from offset, by default the rest of the file.
+        :param transfer_id: the ID shared by all stripes of a striped transfer, None for a whole file.
+        :param stripes: the number of stripes the file was split into.
+        :param fast_open: whether to send the first data segment along with the SYN.
+        :param resume: whether to ask the receiver to carry on from where an earlier attempt at sending the file got to.
         '''
         self.sender_port = int(sender_port)
         self.receiver_port = int(receiver_port)
         self.filename = filename
         self.max_win = int(max_win)
         self.rto = int(rto)
+        self.mss = min(int(mss), MAX_MSS)
+        self.offset = int(offset)
+        self.length = length
+        self.transfer_id = transfer_id
+        self.stripes = int(stripes)
+        self.fast_open = fast_open
+        # stripes are not resumable, their transfer ID changes with every attempt
+        self.resume_id = file_transfer_id(filename) if resume and transfer_id is None else None
 
         # setup ip
         self.sender_address = ("127.0.0.1", self.sender_port)
@@ -49,223 +100,588 @@ class Sender:
         print(f"The sender is using the address {self.sender_address}")
         self.sender_socket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
         self.sender_socket.bind(self.sender_address)
+        # set up by run() once the event loop is running
+        self.loop = None
+        self.transport = None
+
+        # sequence number and payload of the packets sent but not yet acknowledged, keyed by packet index and released once acknowledged
+        self.packets = {}
+        self.segmenter = None
+        # the first segment while it rides with the SYN
+        self.fast_open_data = b''
+        # bytes from offset the receiver already had from an earlier attempt
+        self.resume_offset = 0
+        # CRC-32 of the data from offset, sent along with the FIN
+        self.checksum = 0
+
+        # sequence numbers are 2 bytes until the receiver agrees to 4 byte ones in its answer to the SYN
+        self.seq_bytes = 2
+        self.seq_space = 2**16
+        self.isn = random.randint(0, 2**32 - 1)
+        # tells the receiver this connection apart from an earlier one from the same port
+        self.conn_id = random.randint(0, 2**32 - 1)
+        self.seqno = self.isn
+
+        # sliding window: base is the oldest unacknowledged packet, next is the next packet to send
+        self.base = 0
+        self.next = 0
+        # number of payload bytes sent but not yet acknowledged
+        self.inflight = 0
+        # resolved whenever an ack or a reset changes the connection, to wake up a coroutine waiting on it
+        self.waiter = None
+
+        # one retransmission timer per in flight packet, keyed by packet index
+        self.timers = {}
+        # loop time of the last ack of new data, which restarts every retransmission timer (RFC 6298 5.3)
+        self.last_progress = 0.0
+        # retransmission timer of the outstanding SYN or FIN
+        self.control_timer = None
+        # in flight packets the receiver has selectively acknowledged, these are never retransmitted
+        self.sacked = set()
+
+        # the retransmission timeout follows the round trip times measured from the send times of the packets
+        self.rtt = RttEstimator(self.rto / 1000)
+        self.send_times = {}
+        # packets sent more than once, whose acks are ambiguous and never sampled (Karn's rule)
+        self.retransmitted = set()
+
+        # the congestion window caps the sender window below max_win while the path is congested, set up once the MSS is agreed
+        self.cc_algorithm = ALGORITHMS[cc]
+        self.cc = None
+        # the receive window the receiver advertised in its answer to the SYN, None if it did not
+        self.peer_win = None
+
+        # duplicate acks received for the current send base
+        self.dup_acks = 0
+        # while in fast recovery, the packet index that has to be acknowledged before it ends
+        self.recover = None
 
-        # start the listening sub-thread first
-        self._is_active = True  # for the multi-threading
-        self.listen_thread = Thread(target=self.listen)
-        # starts the listening thread
-        self.listen_thread.start()
-
-        self.packets = []
-
-        self.seqno = random.randint(0, 2**16)
-        self.synced = False
-        # stop and wait
-        self.timer_thread = Thread(target=self.timer_listen)
-
-        self.i = 0
+        self.stats = {
+            'numDataTransferBytes': 0,
+            'numDataSegs': 0,
+            'numDataRetransSegs': 0,
+            'numDupACKS': 0
+        }
+        self.metrics = metrics.ConnectionMetrics('sender', f'{self.sender_address[0]}:{self.sender_port}->{self.receiver_address[0]}:{self.receiver_port}', self.stats)
 
         self.state = State.CLOSED
+        # whether the receiver acknowledged the FIN, so everything was delivered
+        self.complete = False
 
         # when the timer starts counting
         self.start_time = None
-        # the current time that the oldest packet got sent
-        self.curr_packet_time = None
 
         # for tracking number of retransmissions
         self.db = {}
         # for tracking duplicate acks
-        self.acks = {}
-        self.stats = {
-            'numDataTransferBytes': 0,
-            'numDataSegs': 0,
-            'numDataRetransSegs': 0,
-            'numDupACKS': 0
-        }
+        self.last_ack = None
 
-    # for retransmitting packets
-    def timer_listen(self):
-        print('timer thread starting')
-        while self._is_active:
-            while((time.time() - self.curr_packet_time) < (self.rto / 1000)):
-                continue
-            if self.synced == False:
-                if self.state == State.SYN_SENT:
-                    # send RESET segment after 3 failed retransmissions
-                    if self.db['syn'] == 4:
-                        header_type = HeaderType.RESET.value
-                        self.seqno = 0
-                        headers = header_type.to_bytes(2, 'big') + self.seqno.to_bytes(2, 'big')
-                        self.sender_socket.sendto(headers, self.receiver_address)
-                        self.state = State.CLOSED
-                        self._is_active = False
-                        logging.info(f'snd\x20\x20\x20\x20{((time.time()-self.start_time)*1000):.2f}\x20\x20\x20\x20RESET\x20\x20\x20\x20{0}\x20\x20\x20\x20{0}')
-                    else:
-                        header_type = HeaderType.SYN.value
-                        headers = header_type.to_bytes(2, 'big') + (self.seqno-1).to_bytes(2, 'big')
-                        self.sender_socket.sendto(headers, self.receiver_address)
-                        self.db['syn'] += 1
-                        logging.info(f'snd\x20\x20\x20\x20{((time.time()-self.start_time)*1000):.2f}\x20\x20\x20\x20SYN\x20\x20\x20\x20{self.seqno-1}\x20\x20\x20\x20{0}')
-
-                elif self.state == State.ESTABLISHED or self.state == State.CLOSING:
-                    if self.i < len(self.packets):
-                        self.sender_socket.sendto(self.packets[self.i], self.receiver_address)
-                        content_size = int.from_bytes(self.packets[self.i][2:4], byteorder='big')
-                        logging.info(f'snd\x20\x20\x20\x20{((time.time()-self.start_time)*1000):.2f}\x20\x20\x20\x20DATA\x20\x20\x20\x20{content_size}\x20\x20\x20\x20{len(self.packets[self.i][4:])}')
-                        self.stats['numDataRetransSegs'] += 1
-
-                elif self.state == State.FIN_WAIT:
-                    # send RESET segment after 3 failed retransmissions
-                    if self.db['fin'] == 4:
-                        header_type = HeaderType.RESET.value
-                        self.seqno = 0
-                        headers = header_type.to_bytes(2, 'big') + self.seqno.to_bytes(2, 'big')
-                        self.sender_socket.sendto(headers, self.receiver_address)
-                        self.state = State.CLOSED
-                        self._is_active = False
-                        logging.info(f'snd\x20\x20\x20\x20{((time.time()-self.start_time)*1000):.2f}\x20\x20\x20\x20RESET\x20\x20\x20\x20{0}\x20\x20\x20\x20{0}')
-                    else:
-                        header_type = HeaderType.FIN.value
-                        headers = header_type.to_bytes(2, 'big') + (self.seqno-1).to_bytes(2, 'big')
-                        self.sender_socket.sendto(headers, self.receiver_address)
-                        self.db['fin'] += 1
-                        logging.info(f'snd\x20\x20\x20\x20{((time.time()-self.start_time)*1000):.2f}\x20\x20\x20\x20FIN\x20\x20\x20\x20{(self.seqno-1)}\x20\x20\x20\x20{0}')
-                self.curr_packet_time = time.time()
+    @property
+    def state(self):
+        return self._state
+
+    @state.setter
+    def state(self, state):
+        # every change of state is timed by the metrics
+        self._state = state
+        self.metrics.set_state(state)
+
+    def send(self, header: bytes, payload=b'') -> None:
+        send_packet(self.transport, self.sender_socket, self.receiver_address, header, payload)
+
+    def notify(self) -> None:
+        '''
+        Wake up the coroutine waiting for the connection to change
+        '''
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def wait_for(self, predicate) -> None:
+        '''
+        Sleep until predicate holds, checked again every time the connection changes
+        '''
+        while not predicate():
+            self.waiter = self.loop.create_future()
+            await self.waiter
+
+    def elapsed(self) -> float:
+        '''
+        Milliseconds since the SYN was sent, the timestamp of the log
+        '''
+        return (time.time() - self.start_time) * 1000
+
+    def reset(self):
+        '''
+        Abort the connection with a RESET segment
+        '''
+        self.seqno = 0
+        self.send(HEADERS[self.seq_bytes].pack(HeaderType.RESET.value, self.seqno))
+        self.state = State.CLOSED
+        for timer in self.timers.values():
+            timer.cancel()
+        self.timers.clear()
+        tracing.packet(EventType.SND, HeaderType.RESET, 0, 0, self.elapsed())
+        self.notify()
+
+    # retransmits the SYN or FIN if it has not been acknowledged in time
+    def control_timeout(self):
+        if self.state == State.SYN_SENT:
+            # send RESET segment after 3 failed retransmissions
+            if self.db['syn'] == 4:
+                self.reset()
+                return
+            self.send(self.syn_packet())
+            self.db['syn'] += 1
+            tracing.packet(EventType.SND, HeaderType.SYN, self.isn, len(self.fast_open_data), self.elapsed())
+
+        elif self.state == State.FIN_WAIT:
+            # send RESET segment after 3 failed retransmissions
+            if self.db['fin'] == 4:
+                self.reset()
+                return
+            self.send(self.fin_packet())
+            self.db['fin'] += 1
+            tracing.packet(EventType.SND, HeaderType.FIN, (self.seqno - 1) % self.seq_space, 0, self.elapsed())
+
+        else:
+            return
+        self.rtt.timeout()
+        self.control_timer = self.loop.call_later(self.rtt.rto, self.control_timeout)
+
+    # retransmits a data packet whose own timer expired before it was acknowledged
+    def data_timeout(self, index):
+        if self.timers.get(index) is None or index < self.base or index in self.sacked:
+            return
+        # the timers are only restarted here when they fire, rather than all of them on every ack
+        remaining = self.last_progress + self.rtt.rto - self.loop.time()
+        if remaining > 0:
+            self.timers[index] = self.loop.call_later(remaining, self.data_timeout, index)
+            return
+        # back off once per expiry of the oldest packet rather than once per packet of a lost burst
+        if index == self.base:
+            self.rtt.timeout()
+            tracing.rto(self.elapsed(), self.rtt.rto)
+            # a timeout means the recovery did not work out
+            self.recover = None
+            self.cc.on_timeout(self.inflight)
+            self.log_cwnd()
+        self.retransmit(index)
+
+    def retransmit(self, index):
+        '''
+        Resend an in flight packet and restart its timer
+        '''
+        seqno, content = self.packets[index]
+        self.send(HEADERS[self.seq_bytes].pack(HeaderType.DATA.value, seqno), content)
+        tracing.packet(EventType.SND, HeaderType.DATA, seqno, len(content), self.elapsed())
+        self.stats['numDataRetransSegs'] += 1
+        self.metrics.wire_bytes += len(content)
+        self.metrics.wire_segments += 1
+        self.metrics.repeated_segments += 1
+        self.retransmitted.add(index)
+        self.timers[index].cancel()
+        self.timers[index] = self.loop.call_later(self.rtt.rto, self.data_timeout, index)
+
+    def syn_packet(self):
+        '''
+        The SYN keeps the 2 byte header older receivers understand and offers the full 4 byte initial sequence number, the MSS and the connection ID as options
+        '''
+        options = {
+            OptionType.SEQ32.value: self.isn.to_bytes(4, 'big'),
+            OptionType.MSS.value: self.mss.to_bytes(2, 'big'),
+            OptionType.CONN_ID.value: self.conn_id.to_bytes(4, 'big'),
+        }
+        if self.transfer_id is not None:
+            options[OptionType.STRIPE.value] = STRIPE.pack(self.transfer_id, self.offset, self.stripes)
+        if self.resume_id is not None:
+            options[OptionType.RESUME.value] = self.resume_id.to_bytes(4, 'big')
+        if self.fast_open_data:
+            # the last option, announcing the segment that follows the options
+            options[OptionType.FAST_OPEN.value] = len(self.fast_open_data).to_bytes(2, 'big')
+        return HEADERS[2].pack(HeaderType.SYN.value, self.isn % 2**16) + encode_options(options) + self.fast_open_data
+
+    def fin_packet(self):
+        '''
+        The FIN carries the checksum of all the data, for the receiver to verify the file
+        '''
+        return HEADERS[self.seq_bytes].pack(HeaderType.FIN.value, (self.seqno - 1) % self.seq_space) + \
+            encode_options({OptionType.CHECKSUM.value: self.checksum.to_bytes(4, 'big')})
 
     # setup the connection between the sender and receiver
-    def ptp_open(self):
-        # setup the syn packet
-        header_type = HeaderType.SYN.value
-        headers = header_type.to_bytes(2, 'big') + self.seqno.to_bytes(2, 'big')
+    async def ptp_open(self):
         self.state = State.SYN_SENT
+        if self.fast_open:
+            self.segmenter = Segmenter(self.filename, self.mss, self.offset, self.length)
+            # the first segment only rides with the SYN if both still fit a datagram
+            if self.segmenter.count and len(self.syn_packet()) + 4 + self.segmenter.segment_size(0) <= MAX_DATAGRAM:
+                self.fast_open_data = self.segmenter.segment(0)
 
-        self.sender_socket.sendto(headers, self.receiver_address)
+        self.send(self.syn_packet())
         # add the syn to the db so it knows how many syns have been sent so far
         self.db['syn'] = 1
         # this time is to find all the packet times from the intial start time
         self.start_time = time.time()
-        # timer starts from when the syn is send
-        self.curr_packet_time = self.start_time
-        logging.info(f'snd\x20\x20\x20\x20{0:.2f}\x20\x20\x20\x20SYN\x20\x20\x20\x20{self.seqno}\x20\x20\x20\x20{0}')
-        self.seqno = (self.seqno + 1) % (2**16)
-
-        # start timing the syn packet and other packets
-        self.timer_thread.start()
-
-    def ptp_send(self):
-        while self.state != State.ESTABLISHED:
-            if self.state == State.CLOSED:
-                return
-            continue
-        # process text and split them into packets
-        seqno = self.seqno
-        with open(self.filename, mode='r') as file:
-            while True:
-                content = file.read(1000).encode('utf-8')
-                if content:
-                    header_type = HeaderType.DATA.value
-                    headers = header_type.to_bytes(2, 'big') + seqno.to_bytes(2, 'big')
-                    packet = headers + content
-                    self.packets.append(packet)
-                    seqno += len(content) % (2**16)
-                else:
-                    break
-
-        # send the packets
-        while self.i < len(self.packets):
-            if self.synced:
-                if self.i < len(self.packets):
-                    self.sender_socket.sendto(self.packets[self.i], self.receiver_address)
-                    content_size = int.from_bytes(self.packets[self.i][2:4], byteorder='big')
-                    logging.info(f'snd\x20\x20\x20\x20{((time.time()-self.start_time)*1000):.2f}\x20\x20\x20\x20DATA\x20\x20\x20\x20{content_size}\x20\x20\x20\x20{len(self.packets[self.i][4:])}')
-                    self.synced = False
-                    # track the time of the oldest sent out packet
-                    self.curr_packet_time = time.time()
-                    self.stats['numDataTransferBytes'] += len(self.packets[self.i][4:])
-                    self.stats['numDataSegs'] += 1
-        self.state = State.CLOSING
+        self.send_times['syn'] = time.monotonic()
+        tracing.packet(EventType.SND, HeaderType.SYN, self.isn, len(self.fast_open_data), 0)
+        self.seqno = (self.isn + 1) % 2**32
+
+        # start timing the syn packet
+        self.control_timer = self.loop.call_later(self.rtt.rto, self.control_timeout)
+        # sleep until the SYN is acknowledged or the connection is reset
+        await self.wait_for(lambda: self.state != State.SYN_SENT)
+
+    async def ptp_send(self):
+        if self.state == State.CLOSED:
+            return
+        # the file is cut into segments lazily as the window opens, again if the receiver did not agree to the segment size of a fast open
+        if self.segmenter is not None and (self.segmenter.mss != self.mss or self.resume_offset):
+            self.segmenter.close()
+            self.segmenter = None
+        if self.segmenter is None:
+            length = None if self.length is None else self.length - self.resume_offset
+            self.segmenter = Segmenter(self.filename, self.mss, self.offset + self.resume_offset, length)
+        if self.resume_offset:
+            # skip what the receiver already has, though the checksum still covers it
+            tracing.message(f'Resuming from byte {self.resume_offset}')
+            self.checksum = await self.loop.run_in_executor(None, file_checksum, self.filename, self.offset, self.resume_offset)
+        count = self.segmenter.count
+
+        # every ack refills the window from datagram_received, so just wait for the last one or a reset
+        self.fill_window()
+        await self.wait_for(lambda: self.state == State.CLOSED or self.base == count)
+        if self.state != State.CLOSED:
+            self.state = State.CLOSING
 
-    def ptp_close(self):
+    def fill_window(self):
+        '''
+        Send new packets while the window has room for them, keeping at most window bytes unacknowledged
+        '''
+        count = self.segmenter.count
+        while self.state == State.ESTABLISHED and self.next < count and \
+                self.inflight + self.segmenter.segment_size(self.next) <= self.window():
+            content = self.segmenter.segment(self.next)
+            seqno = (self.seqno + self.inflight) % self.seq_space
+            self.packets[self.next] = (seqno, content)
+            # every segment is sent for the first time here, in order
+            self.checksum = zlib.crc32(content, self.checksum)
+            self.send(HEADERS[self.seq_bytes].pack(HeaderType.DATA.value, seqno), content)
+            tracing.packet(EventType.SND, HeaderType.DATA, seqno, len(content), self.elapsed())
+            self.send_times[self.next] = time.monotonic()
+            self.timers[self.next] = self.loop.call_later(self.rtt.rto, self.data_timeout, self.next)
+            self.inflight += len(content)
+            self.next += 1
+            self.stats['numDataTransferBytes'] += len(content)
+            self.stats['numDataSegs'] += 1
+            self.metrics.wire_bytes += len(content)
+            self.metrics.wire_segments += 1
+
+    async def ptp_close(self):
         # dont send the fin if the RESET segment has been sent
         if self.state != State.CLOSED:
             self.state = State.FIN_WAIT
-            logging.info(f'snd\x20\x20\x20\x20{((time.time()-self.start_time)*1000):.2f}\x20\x20\x20\x20FIN\x20\x20\x20\x20{self.seqno}\x20\x20\x20\x20{0}')
-            header_type = HeaderType.FIN.value
-            headers = header_type.to_bytes(2, 'big') + (self.seqno).to_bytes(2, 'big')
-            self.seqno = (self.seqno + 1) % (2**16)
+            tracing.packet(EventType.SND, HeaderType.FIN, self.seqno, 0, self.elapsed())
+            self.seqno = (self.seqno + 1) % self.seq_space
             self.db['fin'] = 1
-            self.sender_socket.sendto(headers, self.receiver_address)
-            self.curr_packet_time = time.time()
-            self.synced = False
-
-        time.sleep(5)
-        self._is_active = False
-        self.sender_socket.close()
-        logging.info(f"Amount of original data transferred in bytes excluding retransmissions: {self.stats['numDataTransferBytes']}")
-        logging.info(f"Number of data segments sent excluding retransmissions: {self.stats['numDataSegs']}")
-        logging.info(f"Number of retransmitted data segments: {self.stats['numDataRetransSegs']}")
-        logging.info(f"Number of duplicate acknowledgements received: {self.stats['numDupACKS']}")
-
-    def listen(self):
-        '''(Multithread is used)listen the response from receiver'''
-        print("Sub-thread for listening is running")
-        while self._is_active:
-            incoming_message = bytes()
-            # decode packet
-            try:
-                incoming_message, _ = self.sender_socket.recvfrom(BUFFERSIZE)
-            # when the socket closes but the socket tries to retrieve a packet we can stop the exception
-            except:
-                break
-
-            header_type = int.from_bytes(incoming_message[0:2], byteorder='big')
-            seqno = int.from_bytes(incoming_message[2:4], byteorder='big')
-
-            if self.acks.get(seqno, 0) != 0:
-                self.stats['numDupACKS'] += 1
-            self.acks[seqno] = self.acks.get(seqno, 0) + 1
-
-            # when the sender is sending a syn, it will wait for the ack to come back
-            if self.state == State.SYN_SENT:
-                if self.seqno == seqno:
-                    self.synced = True
-                    self.state = State.ESTABLISHED
-                    logging.info(f'rcv\x20\x20\x20\x20{((time.time()-self.start_time)*1000):.2f}\x20\x20\x20\x20ACK\x20\x20\x20\x20{self.seqno}\x20\x20\x20\x20{0}')
-
-            elif (self.state == State.ESTABLISHED or self.state == State.CLOSING) and self.i < len(self.packets):
-                print("ACK expected is " + str((self.seqno + len(self.packets[self.i][4:])) % (2**16)) + " | ACK received was " + str(seqno))
-                if ((self.seqno + len(self.packets[self.i][4:])) % (2**16)) == seqno:
-                    self.seqno = (self.seqno + len(self.packets[self.i][4:])) % (2**16)
-                    logging.info(f'rcv\x20\x20\x20\x20{((time.time()-self.start_time)*1000):.2f}\x20\x20\x20\x20ACK\x20\x20\x20\x20{self.seqno}\x20\x20\x20\x20{len(self.packets[self.i][4:])}')
-                    if self.i < len(self.packets):
-                        self.i += 1
-                    self.synced = True
-
-            elif self.state == State.FIN_WAIT:
-                if self.seqno == seqno:
-                    logging.info(f'rcv\x20\x20\x20\x20{((time.time()-self.start_time)*1000):.2f}\x20\x20\x20\x20ACK\x20\x20\x20\x20{self.seqno}\x20\x20\x20\x20{0}')
-                    self.synced = True
-                    self.state = State.CLOSED
-                    # set to false once the ack is received from the fin
-                    self._is_active = False
+            self.send(self.fin_packet())
+            self.control_timer = self.loop.call_later(self.rtt.rto, self.control_timeout)
+            # done as soon as the FIN is acknowledged, or given up on with a RESET
+            await self.wait_for(lambda: self.state == State.CLOSED)
+
+        if self.control_timer is not None:
+            self.control_timer.cancel()
+        self.transport.close()
+        # the in flight payloads are views of the mapped file, so drop them before unmapping it
+        self.packets.clear()
+        self.fast_open_data = b''
+        if self.segmenter is not None:
+            self.segmenter.close()
+        tracing.message(f"Amount of original data transferred in bytes excluding retransmissions: {self.stats['numDataTransferBytes']}")
+        tracing.message(f"Number of data segments sent excluding retransmissions: {self.stats['numDataSegs']}")
+        tracing.message(f"Number of retransmitted data segments: {self.stats['numDataRetransSegs']}")
+        tracing.message(f"Number of duplicate acknowledgements received: {self.stats['numDupACKS']}")
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def error_received(self, exc):
+        # an ICMP error such as port unreachable, the retransmission timers deal with whatever got lost
+        pass
+
+    def datagram_received(self, data, address):
+        '''
+        Handle a response from the receiver
+        '''
+        # decode packet
+        incoming_message = memoryview(data)
+        header = HEADERS[self.seq_bytes]
+        if len(data) < header.size:
+            return
+        header_type, seqno = header.unpack_from(incoming_message)
+
+        if header_type == HeaderType.RESET.value:
+            # the receiver gave up on the connection, such as when the data does not match the checksum of the FIN
+            tracing.packet(EventType.RCV, HeaderType.RESET, seqno, 0, self.elapsed())
+            self.state = State.CLOSED
+            if self.control_timer is not None:
+                self.control_timer.cancel()
+            for timer in self.timers.values():
+                timer.cancel()
+            self.timers.clear()
+            self.notify()
+            return
+
+        # acks are cumulative, so only a repeat of the latest one is a duplicate
+        if seqno == self.last_ack:
+            self.stats['numDupACKS'] += 1
+        self.last_ack = seqno
+
+        # when the sender is sending a syn, it will wait for the ack to come back
+        if self.state == State.SYN_SENT:
+            options = parse_options(incoming_message[HEADERS[2].size:])
+            if OptionType.SEQ32.value in options:
+                # the receiver echoes the full ack number when it agrees to 4 byte sequence numbers
+                seqno = int.from_bytes(options[OptionType.SEQ32.value], byteorder='big')
+                seq_bytes = 4
+            else:
+                # an older receiver ignored the option, so stay with 2 byte sequence numbers
+                seq_bytes = 2
+            # the ack number covers the segment of a fast open if the receiver took it
+            taken = (self.seqno + len(self.fast_open_data)) % 2**(8 * seq_bytes)
+            if self.seqno % 2**(8 * seq_bytes) == seqno or taken == seqno:
+                if OptionType.RESUME.value in options and self.resume_id is not None:
+                    # the receiver holds this much of the file from an earlier attempt, and then never takes the data of the SYN
+                    self.resume_offset = int.from_bytes(options[OptionType.RESUME.value], byteorder='big')
+                if self.fast_open_data and taken == seqno:
+                    size = len(self.fast_open_data)
+                    self.checksum = zlib.crc32(self.fast_open_data, self.checksum)
+                    self.base = self.next = 1
+                    self.stats['numDataTransferBytes'] += size
+                    self.stats['numDataSegs'] += 1
+                    self.metrics.goodput_bytes += size
+                    self.metrics.wire_bytes += size
+                    self.metrics.wire_segments += 1
+                self.fast_open_data = b''
+                self.seq_bytes = seq_bytes
+                self.seq_space = 2**(8 * seq_bytes)
+                self.seqno = seqno
+                # an older receiver does not know about the option either and expects the default segment size
+                self.mss = int.from_bytes(options.get(OptionType.MSS.value, MSS.to_bytes(2, 'big')), byteorder='big')
+                self.cc = self.cc_algorithm(self.max_win, self.mss)
+                if OptionType.WINDOW.value in options:
+                    self.peer_win = int.from_bytes(options[OptionType.WINDOW.value], byteorder='big')
+                self.last_ack = None
+                self.control_timer.cancel()
+                if self.db['syn'] == 1:
+                    self.sample_rtt(self.send_times.pop('syn'))
+                self.state = State.ESTABLISHED
+                tracing.packet(EventType.RCV, HeaderType.ACK, self.seqno, 0, self.elapsed())
+
+        elif self.state == State.ESTABLISHED or self.state == State.CLOSING:
+            # acks are cumulative, so one ack can cover several packets in the window
+            acked = (seqno - self.seqno) % self.seq_space
+            if 0 < acked <= self.inflight:
+                tracing.packet(EventType.RCV, HeaderType.ACK, seqno, acked, self.elapsed())
+                # an ack covering a retransmitted packet may be for either copy, so it is not sampled
+                ambiguous = False
+                newly_acked = acked
+                while self.base < self.next and acked >= len(self.packets[self.base][1]):
+                    size = len(self.packets.pop(self.base)[1])
+                    acked -= size
+                    self.inflight -= size
+                    self.seqno = (self.seqno + size) % self.seq_space
+                    self.timers.pop(self.base).cancel()
+                    self.sacked.discard(self.base)
+                    if self.base in self.retransmitted:
+                        self.retransmitted.discard(self.base)
+                        ambiguous = True
+                    send_time = self.send_times.pop(self.base)
+                    self.base += 1
+                self.metrics.goodput_bytes += newly_acked - acked
+                self.last_progress = self.loop.time()
+                rtt = None if ambiguous else self.sample_rtt(send_time)
+                self.dup_acks = 0
+                if self.recover is None:
+                    self.cc.on_ack(newly_acked, rtt)
+                    self.log_cwnd()
+                else:
+                    if self.base >= self.recover:
+                        self.recover = None
+                        self.cc.on_recovery_end()
+                        self.log_cwnd()
+                    else:
+                        # a partial ack points straight at the next hole, so resend it without waiting for three more duplicates
+                        self.retransmit(self.base)
+            elif acked == 0 and self.inflight > 0:
+                self.dup_acks += 1
+                # fast retransmit the send base and recover everything sent so far without waiting for the timer
+                if self.dup_acks == DUP_ACK_THRESHOLD and self.recover is None:
+                    self.recover = self.next
+                    self.cc.on_recovery_start(self.inflight)
+                    self.log_cwnd()
+                    self.retransmit(self.base)
+                elif self.recover is not None:
+                    self.cc.on_recovery_dup_ack()
+                    self.log_cwnd()
+            self.process_sack(incoming_message[header.size:])
+            if self.segmenter is not None:
+                self.fill_window()
+                self.metrics.window.observe(self.inflight / self.window())
+
+        elif self.state == State.FIN_WAIT:
+            if self.seqno == seqno:
+                tracing.packet(EventType.RCV, HeaderType.ACK, self.seqno, 0, self.elapsed())
+                self.control_timer.cancel()
+                self.state = State.CLOSED
+                self.complete = True
+            elif (self.seqno - 1) % self.seq_space == seqno:
+                # the receiver has the FIN but is still checking what it kept from an earlier attempt, so keep waiting
+                tracing.packet(EventType.RCV, HeaderType.ACK, seqno, 0, self.elapsed())
+                self.db['fin'] = 1
+        self.notify()
+
+    def sample_rtt(self, send_time):
+        '''
+        Update the retransmission timeout from the packet sent at send_time that was just acknowledged
+        '''
+        rtt = time.monotonic() - send_time
+        self.rtt.sample(rtt)
+        tracing.rtt(self.elapsed(), rtt, self.rtt.rto)
+        self.metrics.rtt.observe(rtt * 1000)
+        return rtt
+
+    def window(self):
+        '''
+        The number of bytes allowed in flight, a window smaller than one segment degrades to stop and wait
+        '''
+        # more than half the sequence space in flight would make old and new acks indistinguishable
+        window = min(self.cc.cwnd, self.max_win, self.seq_space // 2)
+        if self.peer_win is not None:
+            # anything past the receive window would be dropped by the receiver
+            window = min(window, self.peer_win)
+        return max(window, self.mss)
+
+    def log_cwnd(self):
+        tracing.cwnd(self.elapsed(), self.cc.cwnd, self.cc.ssthresh)
+
+    def process_sack(self, blocks):
+        '''
+        Stop the timers of in flight packets covered by the SACK blocks of an ack
+        :param blocks: pairs of start and end sequence numbers following the ack header
+        '''
+        block = SACK_BLOCKS[self.seq_bytes]
+        for i in range(0, len(blocks) - block.size + 1, block.size):
+            start, end = block.unpack_from(blocks, i)
+            start = (start - self.seqno) % self.seq_space
+            end = (end - self.seqno) % self.seq_space
+            if end > self.inflight:
+                continue
+            offset = 0
+            for index in range(self.base, self.next):
+                size = len(self.packets[index][1])
+                if start <= offset and offset + size <= end and index not in self.sacked:
+                    self.sacked.add(index)
+                    self.timers[index].cancel()
+                offset += size
 
     # controller
-    def run(self):
-        self.ptp_open()
-        self.ptp_send()
-        self.ptp_close()
+    async def run(self) -> bool:
+        '''
+        Transfer the file
+        :return: whether the receiver acknowledged all of it
+        '''
+        self.loop = asyncio.get_running_loop()
+        await self.loop.create_datagram_endpoint(lambda: self, sock=self.sender_socket)
+        metrics.register(self.metrics)
+        await self.ptp_open()
+        await self.ptp_send()
+        await self.ptp_close()
+        metrics.finish(self.metrics)
+        return self.complete
+
+
+def file_transfer_id(filename: str) -> int:
+    '''
+    The transfer ID of a resumable transfer, the same on every attempt at sending the file until it changes
+    '''
+    info = os.stat(filename)
+    return zlib.crc32(f'{os.path.abspath(filename)}:{info.st_size}:{info.st_mtime_ns}'.encode())
+
+
+def stripe_ranges(size: int, stripes: int, mss: int) -> list:
+    '''
+    Split a file into at most the given number of byte ranges of whole segments, one per connection
+    :return: the offset and length of every stripe
+    '''
+    length = -(-size // max(stripes, 1))
+    # round up to whole segments so only the last stripe ends in a short one
+    length = max(-(-length // mss) * mss, mss)
+    return [(offset, min(length, size - offset)) for offset in range(0, size, length)] or [(0, 0)]
+
+
+def run_stripe(*args) -> bool:
+    '''
+    Send one stripe with the arguments of Sender in a worker process, which runs an event loop of its own
+    '''
+    try:
+        return asyncio.run(Sender(*args).run())
+    finally:
+        tracing.flush()
+
+
+async def send_striped(sender_port: int, receiver_port: int, filename: str, max_win: int, rto: int, cc: str = 'reno', mss: int = MSS,
+                       stripes: int = 2, processes: int = 0, fast_open: bool = False) -> bool:
+    '''
+    Send a file over several connections at once, stripe i from sender_port + i
+    :param processes: the number of worker processes to spread the stripes over, or 0 to run them all in this event loop
+    :param fast_open: whether every stripe sends its first data segment along with the SYN
+    :return: whether the receiver acknowledged the FIN of every stripe
+    '''
+    ranges = stripe_ranges(os.path.getsize(filename), stripes, min(mss, MAX_MSS))
+    transfer_id = random.randint(0, 2**32 - 1)
+    args = [(sender_port + i, receiver_port, filename, max_win, rto, cc, mss, offset, length, transfer_id, len(ranges), fast_open)
+            for i, (offset, length) in enumerate(ranges)]
+    if processes:
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(processes) as pool:
+            results = await asyncio.gather(*(loop.run_in_executor(pool, run_stripe, *stripe) for stripe in args))
+    else:
+        results = await asyncio.gather(*(Sender(*stripe).run() for stripe in args))
+    return all(results)
+
 
 if __name__ == '__main__':
-    logging.basicConfig(
-        filename="Sender_log.txt",
-        format='',
-        level=logging.DEBUG,
-        filemode='w')
-
-    if len(sys.argv) != 6:
-        print(
-            "\n===== Error usage, python3 sender.py sender_port receiver_port FileReceived.txt max_win rto ======\n")
-        exit(0)
-
-    sender = Sender(*sys.argv[1:])
-    sender.run()
+    parser = argparse.ArgumentParser(usage="python3 sender.py sender_port receiver_port FileReceived.txt max_win rto [--cc reno|vegas] [--mss bytes] [--stripes n] [--processes n] [--fast-open] [--resume]\n"
+                                           "       [--trace-level summary|connection|packet] [--trace file]\n"
+                                           "       [--metrics file] [--metrics-interval seconds] [--metrics-port port]")
+    parser.add_argument('sender_port', type=int)
+    parser.add_argument('receiver_port', type=int)
+    parser.add_argument('filename')
+    parser.add_argument('max_win', type=int)
+    parser.add_argument('rto', type=int)
+    parser.add_argument('--cc', choices=ALGORITHMS, default='reno', help='congestion control algorithm')
+    parser.add_argument('--mss', type=int, default=MSS, help=f'segment size to propose, at most {MAX_MSS} bytes')
+    parser.add_argument('--stripes', type=int, default=1, help='number of connections to split the file over, from consecutive sender ports')
+    parser.add_argument('--processes', type=int, default=0, help='number of worker processes to run the stripes in, 0 runs them all in one event loop')
+    parser.add_argument('--fast-open', action='store_true', help='send the first data segment along with the SYN')
+    parser.add_argument('--resume', action='store_true', help='carry on from where an earlier attempt at sending the file got to')
+    parser.add_argument('--trace-level', choices=[level.name.lower() for level in TraceLevel], default='packet', help='the most detailed events to log')
+    parser.add_argument('--trace', default='Sender_trace.bin', help='binary trace file, converted into Sender_log.txt at the end')
+    parser.add_argument('--metrics', help='file to write live metrics and the final summary to as JSON lines')
+    parser.add_argument('--metrics-interval', type=float, default=metrics.INTERVAL, help='seconds between metrics lines')
+    parser.add_argument('--metrics-port', type=int, help='local port to serve live metrics on over HTTP')
+    args = parser.parse_args()
+
+    tracing.configure(args.trace, TraceLevel[args.trace_level.upper()])
+    try:
+        if args.stripes > 1:
+            complete = asyncio.run(metrics.serve(send_striped(args.sender_port, args.receiver_port, args.filename, args.max_win, args.rto,
+                                                             args.cc, args.mss, args.stripes, args.processes, args.fast_open),
+                                                args.metrics, args.metrics_interval, args.metrics_port))
+            print(f"Striped transfer of {args.filename} {'complete' if complete else 'failed'}")
+            sys.exit(0 if complete else 1)
+        sender = Sender(args.sender_port, args.receiver_port, args.filename, args.max_win, args.rto, args.cc, args.mss,
+                        fast_open=args.fast_open, resume=args.resume)
+        complete = asyncio.run(metrics.serve(sender.run(), args.metrics, args.metrics_interval, args.metrics_port))
+        sys.exit(0 if complete else 1)
+    finally:
+        tracing.close("Sender_log.txt")
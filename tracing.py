@@ -0,0 +1,231 @@
+"""
+    Binary event tracing for the sender and receiver
+    Python 3
+    Usage: python3 tracing.py Sender_trace.bin Sender_log.txt
+    coding: utf-8
+
+    Instead of formatting a line of text for every packet, events are packed as fixed size records into a
+    preallocated ring buffer, which a background thread drains to the trace file. Messages, such as the stats
+    at the end of a transfer, are rare and written straight away as a record followed by their text.
+
+    Running this module converts a trace file back into the text log format of the sender and receiver.
+"""
+import math, os, struct, sys
+from threading import Thread, Lock, Event
+
+from type_enums import HeaderType, EventType, TraceLevel
+
+# milliseconds since the start of the connection, event type, header type, then the sequence number and length
+# of a packet, or the two values of any other event
+RECORD = struct.Struct('<dBBII')
+# first bytes of every trace file, the last one being the version of the format
+MAGIC = b'PTPTRACE\x01'
+# records the ring buffer holds before a producer has to write them out itself
+RING_RECORDS = 1 << 16
+# seconds between drains of the ring buffer when it is not filling up
+FLUSH_INTERVAL = 0.2
+
+
+class Tracer:
+    def __init__(self, path: str, level: TraceLevel = TraceLevel.PACKET, capacity: int = RING_RECORDS) -> None:
+        '''
+        :param path: the trace file, truncated if it already exists
+        :param level: the most detailed events to record
+        :param capacity: the size of the ring buffer in records
+        '''
+        self.path = path
+        self.level = level
+        self.capacity = capacity
+        self.ring = bytearray(capacity * RECORD.size)
+        self.view = memoryview(self.ring)
+        # records are packed at head and written out from tail, both counted from the start so head - tail is the backlog
+        self.head = 0
+        self.tail = 0
+        with open(path, 'wb') as file:
+            file.write(MAGIC)
+        # appending keeps the records whole when forked worker processes share the file
+        self.file = open(path, 'ab', buffering=0)
+        # serialises writing between the background thread and a producer that found the ring full
+        self.lock = Lock()
+        self.wakeup = Event()
+        self.running = True
+        self.start()
+
+    def start(self) -> None:
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        while self.running:
+            self.wakeup.wait(FLUSH_INTERVAL)
+            self.wakeup.clear()
+            self.drain()
+
+    def record(self, event: int, header_type: int, first: int, second: int, elapsed: float) -> None:
+        if self.head - self.tail == self.capacity:
+            # the writer fell behind, so write the backlog out here rather than lose records
+            self.drain()
+        RECORD.pack_into(self.ring, self.head % self.capacity * RECORD.size, elapsed, event, header_type, first, second)
+        self.head += 1
+        if self.head - self.tail == self.capacity // 2:
+            self.wakeup.set()
+
+    def packet(self, event: int, header_type: int, seqno: int, length: int, elapsed: float) -> None:
+        '''
+        Record a packet sent, received or dropped, DATA and ACK packets at the PACKET level and the rest at the CONNECTION level
+        '''
+        if self.level >= (TraceLevel.PACKET if header_type <= HeaderType.ACK.value else TraceLevel.CONNECTION):
+            self.record(event, header_type, seqno, length, elapsed)
+
+    def message(self, text: str) -> None:
+        data = text.encode()
+        with self.lock:
+            self._drain()
+            self.file.write(RECORD.pack(0, EventType.MESSAGE.value, 0, 0, len(data)) + data)
+
+    def drain(self) -> None:
+        with self.lock:
+            self._drain()
+
+    def _drain(self) -> None:
+        head = self.head
+        if head == self.tail:
+            return
+        start = self.tail % self.capacity * RECORD.size
+        end = head % self.capacity * RECORD.size
+        if start < end:
+            self.file.write(self.view[start:end])
+        else:
+            self.file.write(self.view[start:])
+            self.file.write(self.view[:end])
+        self.tail = head
+
+    def close(self) -> None:
+        self.running = False
+        self.wakeup.set()
+        self.thread.join()
+        self.drain()
+        self.file.close()
+
+    def after_fork(self) -> None:
+        '''
+        Carry on in a forked child, leaving the parent's backlog to the parent
+        '''
+        self.tail = self.head
+        self.lock = Lock()
+        self.wakeup = Event()
+        self.start()
+
+
+# the tracer of this process, set up by configure
+_tracer = None
+
+
+def configure(path: str, level: TraceLevel = TraceLevel.PACKET) -> None:
+    global _tracer
+    _tracer = Tracer(path, level)
+
+
+def packet(event: EventType, header_type: HeaderType, seqno: int, length: int, elapsed: float) -> None:
+    '''
+    :param elapsed: milliseconds since the start of the connection, or nan before it started
+    '''
+    if _tracer is not None:
+        _tracer.packet(event.value, header_type.value, seqno, length, elapsed)
+
+
+def rtt(elapsed: float, sample: float, timeout: float) -> None:
+    '''
+    :param sample: the round trip time sample in seconds
+    :param timeout: the retransmission timeout it leads to in seconds
+    '''
+    if _tracer is not None and _tracer.level >= TraceLevel.PACKET:
+        _tracer.record(EventType.RTT.value, 0, round(sample * 1e6), round(timeout * 1e6), elapsed)
+
+
+def rto(elapsed: float, timeout: float) -> None:
+    if _tracer is not None and _tracer.level >= TraceLevel.CONNECTION:
+        _tracer.record(EventType.RTO.value, 0, round(timeout * 1e6), 0, elapsed)
+
+
+def cwnd(elapsed: float, cwnd: int, ssthresh: int) -> None:
+    if _tracer is not None and _tracer.level >= TraceLevel.PACKET:
+        _tracer.record(EventType.CWND.value, 0, cwnd, ssthresh, elapsed)
+
+
+def message(text: str) -> None:
+    if _tracer is not None:
+        _tracer.message(text)
+
+
+def flush() -> None:
+    '''
+    Write out everything recorded so far, for a worker process about to exit without closing the tracer
+    '''
+    if _tracer is not None:
+        _tracer.drain()
+
+
+def close(log_path: str = None) -> None:
+    '''
+    Stop tracing and write everything out
+    :param log_path: a text log to convert the trace into afterwards
+    '''
+    global _tracer
+    if _tracer is None:
+        return
+    _tracer.close()
+    if log_path is not None:
+        convert(_tracer.path, log_path)
+    _tracer = None
+
+
+def _after_fork() -> None:
+    if _tracer is not None:
+        _tracer.after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def format_record(event: int, header_type: int, first: int, second: int, elapsed: float) -> str:
+    '''
+    The line of the text log an event record stands for
+    '''
+    if event == EventType.RTT.value:
+        return f'rtt\x20\x20\x20\x20{elapsed:.2f}\x20\x20\x20\x20{first/1000:.2f}\x20\x20\x20\x20{second/1000:.2f}'
+    if event == EventType.RTO.value:
+        return f'rto\x20\x20\x20\x20{elapsed:.2f}\x20\x20\x20\x20{first/1000:.2f}\x20\x20\x20\x20{0}'
+    if event == EventType.CWND.value:
+        return f'cwnd\x20\x20\x20\x20{elapsed:.2f}\x20\x20\x20\x20{first}\x20\x20\x20\x20{second}'
+    # the SYN may be dropped before the connection has a start time
+    timestamp = 'uninitalised' if math.isnan(elapsed) else f'{elapsed:.2f}'
+    return f'{EventType(event).name.lower()}\x20\x20\x20\x20{timestamp}\x20\x20\x20\x20{HeaderType(header_type).name}\x20\x20\x20\x20{first}\x20\x20\x20\x20{second}'
+
+
+def convert(trace_path: str, log_path: str) -> None:
+    '''
+    Write the text log a trace file stands for
+    '''
+    with open(trace_path, 'rb') as file:
+        data = file.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f'{trace_path} is not a trace file')
+    i = len(MAGIC)
+    with open(log_path, 'w') as log:
+        while i + RECORD.size <= len(data):
+            elapsed, event, header_type, first, second = RECORD.unpack_from(data, i)
+            i += RECORD.size
+            if event == EventType.MESSAGE.value:
+                log.write(data[i:i + second].decode() + '\n')
+                i += second
+            else:
+                log.write(format_record(event, header_type, first, second, elapsed) + '\n')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage: python3 tracing.py Sender_trace.bin Sender_log.txt")
+        sys.exit(1)
+    convert(sys.argv[1], sys.argv[2])
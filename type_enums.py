@@ -1,8 +1,50 @@
-from enum import Enum
+from enum import Enum, IntEnum
 
 class HeaderType (Enum):
     DATA = 0
     ACK = 1
     SYN = 2
     FIN = 3
-    RESET = 4
\ No newline at end of file
+    RESET = 4
+
+# options carried in the payload of a SYN and of the ACK that answers it, and of a FIN
+class OptionType (Enum):
+    # 4 byte initial sequence number, asking for 4 byte sequence numbers for the rest of the connection
+    SEQ32 = 1
+    # 2 byte maximum segment size, proposed by the sender and capped by the receiver in its answer
+    MSS = 2
+    # 4 byte connection ID picked by the sender, telling a new connection from a retransmitted SYN of the current one
+    CONN_ID = 3
+    # 4 byte transfer ID, 8 byte file offset and 2 byte stripe count of a connection carrying one stripe of a file
+    STRIPE = 4
+    # 2 byte length of the first data segment, which follows the options of a SYN sent in fast open mode
+    FAST_OPEN = 5
+    # 4 byte transfer ID of a resumable transfer in the SYN, answered with the 8 byte offset to resume from
+    RESUME = 6
+    # 4 byte CRC-32 of all the data of the connection, carried by the FIN
+    CHECKSUM = 7
+    # 4 byte receive window in the answer to the SYN, the most bytes past the next expected one the receiver takes
+    WINDOW = 8
+
+# what a trace record describes, a packet event being named after its direction like the lines of the text log
+class EventType (Enum):
+    SND = 0
+    RCV = 1
+    DRP = 2
+    # round trip time sample and the retransmission timeout it leads to
+    RTT = 3
+    # retransmission timeout after backing off
+    RTO = 4
+    # congestion window and slow start threshold
+    CWND = 5
+    # a line of text, such as the stats at the end of a transfer
+    MESSAGE = 6
+
+# how much goes into the trace, each level including the ones below it
+class TraceLevel (IntEnum):
+    # only the messages, so the stats at the end
+    SUMMARY = 0
+    # plus the SYN, FIN and RESET packets and the retransmission timeouts
+    CONNECTION = 1
+    # plus every DATA and ACK packet, round trip time sample and congestion window change
+    PACKET = 2
@@ -0,0 +1,85 @@
+"""
+    Offset addressed output file for the receiver
+    Python 3
+    coding: utf-8
+
+    The file is opened once in binary mode and every segment is written at its own byte offset, so out of order
+    segments go straight to disk and runs of contiguous segments are coalesced into a single large write.
+    Written bytes can be read back, so the receiver can checksum out of order segments once the gap before
+    them is filled without keeping them in memory.
+"""
+import os
+
+# contiguous bytes collected before they are written out
+COALESCE_BYTES = 256 * 1024
+
+
+class FileWriter:
+    def __init__(self, filename: str, coalesce: int = COALESCE_BYTES, truncate: bool = True) -> None:
+        '''
+        :param filename: the file to write, created if it does not exist
+        :param coalesce: the number of contiguous bytes to collect before writing them out in one call
+        :param truncate: whether to empty an existing file, rather than write into it next to other writers or after an earlier attempt
+        '''
+        if truncate:
+            self.file = open(filename, 'wb+')
+        else:
+            self.file = open(os.open(filename, os.O_RDWR | os.O_CREAT, 0o666), 'rb+')
+        self.fd = self.file.fileno()
+        self.coalesce = coalesce
+        # contiguous bytes not yet written, starting at pending_offset
+        self.pending = bytearray()
+        self.pending_offset = 0
+
+    def write(self, offset: int, data) -> None:
+        '''
+        Write data at a byte offset of the file, deferring the write while it extends the pending run
+        :param data: any bytes-like object, copied before this returns so a reused receive buffer is safe to pass
+        '''
+        if self.pending and offset != self.pending_offset + len(self.pending):
+            self.flush()
+        if not self.pending:
+            self.pending_offset = offset
+        self.pending += data
+        if len(self.pending) >= self.coalesce:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        if hasattr(os, 'pwrite'):
+            os.pwrite(self.fd, self.pending, self.pending_offset)
+        else:
+            # no positional writes on this platform, so seek first
+            os.lseek(self.fd, self.pending_offset, os.SEEK_SET)
+            os.write(self.fd, self.pending)
+        self.pending.clear()
+
+    def read(self, offset: int, length: int) -> bytes:
+        '''
+        Read back bytes written earlier, writing out anything pending first
+        '''
+        self.flush()
+        if hasattr(os, 'pread'):
+            return os.pread(self.fd, length, offset)
+        os.lseek(self.fd, offset, os.SEEK_SET)
+        return os.read(self.fd, length)
+
+    def sync(self) -> None:
+        '''
+        Write out anything pending and make it durable
+        '''
+        self.flush()
+        os.fsync(self.fd)
+
+    def close(self, sync: bool = False) -> None:
+        '''
+        Write out anything pending and close the file
+        :param sync: whether to fsync the file first, done once the whole transfer has arrived
+        '''
+        if self.file.closed:
+            return
+        self.flush()
+        if sync:
+            os.fsync(self.fd)
+        self.file.close()